@@ -0,0 +1,421 @@
+#!python3
+# -*- coding:utf-8 -*-
+"""
+Output backends used by AudioWriter.
+
+A backend owns the output device and the queue of blocks scheduled on it:
+
+    open(wavefx)               - prepare the device for the WAVEFORMATEX format
+    freeBlocks()               - indexes of blocks that can be (re)scheduled
+    scheduleBlock(data, index) - queue PCM data using block `index`, data may
+                                 be bytes or a writable buffer (bytearray,
+                                 memoryview) that must not change until the
+                                 block is done
+    waitCompletion(timeout)    - block until the oldest queued block is played
+    close()                    - release the device
+
+The ring of `blockCount` blocks trades latency for underrun resistance:
+up to blockCount blocks are queued on the device, the writer sleeps in
+waitCompletion until the device signals that one of them is done. Blocks
+scheduled after the device ran out of queued audio count as `underruns`,
+the latency module sizes blocks and ring from them.
+
+WinmmBackend plays through the Windows waveOut interface and is the only
+backend that loads winmm. NullBackend and FileBackend are headless sinks
+driven by a VirtualClock, they complete blocks as fast as the CPU allows
+unless created with realtime=True.
+"""
+
+import sys
+import time
+import collections
+import wave
+import ctypes
+from ctypes import wintypes
+
+DEBUG = False
+def debug(msg):
+    if DEBUG:
+        print("debug: %s" % msg)
+
+# --- define necessary data structures from mmsystem.h
+
+# 1. Open Sound Device
+
+HWAVEOUT = wintypes.HANDLE
+WAVE_FORMAT_PCM = 0x1
+WAVE_MAPPER = -1
+MMSYSERR_NOERROR = 0
+
+class WAVEFORMATEX(ctypes.Structure):
+    _fields_ = [
+        ('wFormatTag',  wintypes.WORD),
+            # 0x0001    WAVE_FORMAT_PCM. PCM audio
+            # 0xFFFE    The format is specified in the WAVEFORMATEXTENSIBLE.SubFormat
+            # Other values are in mmreg.h
+        ('nChannels',   wintypes.WORD),
+        ('SamplesPerSec',  wintypes.DWORD),
+        ('AvgBytesPerSec', wintypes.DWORD),
+            # for WAVE_FORMAT_PCM is the product of nSamplesPerSec and nBlockAlign
+        ('nBlockAlign', wintypes.WORD),
+            # for WAVE_FORMAT_PCM is the product of nChannels and wBitsPerSample
+            # divided by 8 (bits per byte)
+        ('wBitsPerSample', wintypes.WORD),
+            # for WAVE_FORMAT_PCM should be equal to 8 or 16
+        ('cbSize',      wintypes.WORD)]
+            # extra format information size, should be 0
+
+# Data must be processes in pieces that are multiple of
+# nBlockAlign bytes of data at a time. Written and read
+# data from a device must always start at the beginning
+# of a block. Playback of PCM data can not be started in
+# the middle of a sample on a non-block-aligned boundary.
+
+CALLBACK_NULL = 0
+
+# 2. Write Audio Blocks to Device
+
+PVOID = wintypes.HANDLE
+WAVERR_BASE = 32
+WAVERR_STILLPLAYING = WAVERR_BASE + 1
+class WAVEHDR(ctypes.Structure):
+    _fields_ = [
+        ('lpData', wintypes.LPSTR), # pointer to waveform buffer
+        ('dwBufferLength', wintypes.DWORD),  # in bytes
+        ('dwBytesRecorded', wintypes.DWORD), # when used in input
+        ('dwUser', wintypes.DWORD),          # user data
+        ('dwFlags', wintypes.DWORD),  # various WHDR_* flags set by Windows
+        ('dwLoops', wintypes.DWORD),  # times to loop, for output buffers only
+        ('lpNext', PVOID),            # reserved, struct wavehdr_tag *lpNext
+        ('reserved', wintypes.DWORD)] # reserved
+# The lpData, dwBufferLength, and dwFlags members must be set before calling
+# the waveInPrepareHeader or waveOutPrepareHeader function. (For either
+# function, the dwFlags member must be set to zero.)
+WHDR_DONE = 1  # Set by the device driver for finished buffers
+# --- /define ----------------------------------------
+
+
+def defaultFormat():
+    """PCM 16bit, little endian, signed, 44.1kHz, stereo, left interleaved"""
+    return WAVEFORMATEX(
+        WAVE_FORMAT_PCM,
+        2,     # nChannels
+        44100, # SamplesPerSec
+        176400,# AvgBytesPerSec = 44100 SamplesPerSec * 4 nBlockAlign
+        4,     # nBlockAlign = 2 nChannels * 16 wBitsPerSample / 8 bits per byte
+        16,    # wBitsPerSample
+        0
+    )
+
+
+def describeFormat(wavefx):
+    """short text like 'tag 1 44100Hz 2ch 16bit', equal for equal formats"""
+    return 'tag %d %dHz %dch %dbit' % (wavefx.wFormatTag, wavefx.SamplesPerSec,
+                                        wavefx.nChannels, wavefx.wBitsPerSample)
+
+
+class AudioBackend(object):
+    """Base class of output backends, see module documentation.
+
+         Subclasses write blocks in _write and wait for the completion of a
+         block in _waitDone, the queue of scheduled blocks is kept here."""
+    def __init__(self, blockCount=2):
+        #: number of audio data blocks that can be queued at a time
+        self.blockCount = blockCount
+        self.wavefx = None
+        #: indexes of scheduled blocks in playback order
+        self.pending = collections.deque()
+        #: size of the last scheduled block in bytes
+        self.blockSize = 0
+        #: blocks scheduled after the device played all queued blocks
+        self.underruns = 0
+
+    def setBlockCount(self, blockCount):
+        """change the depth of the ring while no block is scheduled"""
+        if self.pending:
+            raise RuntimeError('can not resize the ring while blocks are scheduled')
+        self.blockCount = blockCount
+
+    def open(self, wavefx):
+        self.wavefx = wavefx
+        self.pending.clear()
+        self.underruns = 0
+
+    def freeBlocks(self):
+        return [x for x in range(self.blockCount) if x not in self.pending]
+
+    def scheduleBlock(self, data, index):
+        self._write(data, index)
+        self.pending.append(index)
+
+    def waitCompletion(self, timeout=None):
+        """Wait until the oldest scheduled block is played and return its
+             index. Returns None if no block is scheduled or on timeout."""
+        if not self.pending:
+            return None
+        index = self.pending[0]
+        if not self._waitDone(index, timeout):
+            return None
+        self.pending.popleft()
+        return index
+
+    def latency(self):
+        """seconds of audio the full ring holds for blocks of `blockSize` bytes"""
+        return self.blockCount * self.blockSize / float(self.wavefx.AvgBytesPerSec)
+
+    def _write(self, data, index):
+        raise NotImplementedError
+
+    def _waitDone(self, index, timeout):
+        raise NotImplementedError
+
+    def close(self):
+        self.pending.clear()
+
+
+# -- Notes on buffering scheme to avoid lags --
+#
+# Windows maintains a queue of blocks sheduled for playback.
+# Any block passed through the waveOutPrepareHeader function
+# is inserted into the queue with waveOutWrite. The device is opened
+# with CALLBACK_EVENT, so Windows signals an event every time a block is
+# done and the writer can sleep on it instead of polling the headers.
+
+CALLBACK_EVENT = 0x50000
+WAIT_TIMEOUT = 0x102
+INFINITE = 0xFFFFFFFF
+
+class WinmmBackend(AudioBackend):
+    """Play blocks through the default Windows waveOut device"""
+    def __init__(self, blockCount=2):
+        super(WinmmBackend, self).__init__(blockCount)
+        self.winmm = ctypes.windll.winmm
+        self.kernel32 = ctypes.windll.kernel32
+        self.kernel32.CreateEventW.restype = wintypes.HANDLE
+        self.hwaveout = HWAVEOUT()
+        self.hevent = None
+        # For gapless playback, we schedule several audio blocks at a time,
+        # each block with its own header
+        self.headers = [WAVEHDR() for i in range(blockCount)]
+
+    def setBlockCount(self, blockCount):
+        super(WinmmBackend, self).setBlockCount(blockCount)
+        self.headers += [WAVEHDR() for i in range(blockCount - len(self.headers))]
+
+    def open(self, wavefx):
+        """ 1. Open default wave device, tune it for the incoming data flow
+        """
+        super(WinmmBackend, self).open(wavefx)
+        # auto-reset event, signaled by the driver when a block is done
+        self.hevent = self.kernel32.CreateEventW(None, False, False, None)
+        ret = self.winmm.waveOutOpen(
+            ctypes.byref(self.hwaveout), # buffer to receive a handle identifying
+                                                            # the open waveform-audio output device
+            WAVE_MAPPER,            # constant to point to default wave device
+            ctypes.byref(self.wavefx),   # identifier for data format sent for device
+            wintypes.HANDLE(self.hevent), # DWORD_PTR dwCallback - event handle
+            0, # DWORD_PTR dwCallbackInstance - user instance data for callback
+            CALLBACK_EVENT  # DWORD fdwOpen - flag for opening the device
+        )
+
+        if ret != MMSYSERR_NOERROR:
+            sys.exit('Error opening default waveform audio device (WAVE_MAPPER)')
+
+        # volume = 10|(10<<16)
+        # self.winmm.waveOutSetVolume(self.hwaveout, volume)
+        debug( "Default Wave Audio output device is opened successfully" )
+
+    def _write(self, data, index):
+        """Schedule PCM audio data block for playback. index parameter
+             references free WAVEHDR structure to be used for scheduling."""
+        if self.pending and all(self.headers[i].dwFlags & WHDR_DONE for i in self.pending):
+            self.underruns += 1
+        header = self.headers[index]
+        header.dwBufferLength = len(data)
+        if isinstance(data, bytes):
+            header.lpData = data
+        else:
+            # point the header into the caller's buffer instead of copying it
+            address = ctypes.addressof(ctypes.c_char.from_buffer(data))
+            header.lpData = ctypes.cast(address, wintypes.LPSTR)
+        header.dwFlags = 0
+        self.blockSize = len(data)
+
+        # Prepare block for playback
+        if self.winmm.waveOutPrepareHeader(
+                 self.hwaveout, ctypes.byref(header), ctypes.sizeof(header)
+             ) != MMSYSERR_NOERROR:
+            sys.exit('Error: waveOutPrepareHeader failed')
+
+        # Write block, returns immediately unless a synchronous driver is
+        # used (not often)
+        if self.winmm.waveOutWrite(
+                 self.hwaveout, ctypes.byref(header), ctypes.sizeof(header)
+             ) != MMSYSERR_NOERROR:
+            sys.exit('Error: waveOutWrite failed')
+
+    def _waitDone(self, index, timeout):
+        header = self.headers[index]
+        waitMs = INFINITE if timeout is None else int(timeout * 1000)
+        # the event is auto-reset and stays signaled if the block finished
+        # after the flag check, so a completion can not be missed
+        while not header.dwFlags & WHDR_DONE:
+            if self.kernel32.WaitForSingleObject(wintypes.HANDLE(self.hevent), waitMs) == WAIT_TIMEOUT:
+                return False
+        self._unprepare(header)
+        return True
+
+    def _unprepare(self, header):
+        ret = self.winmm.waveOutUnprepareHeader(
+                        self.hwaveout,
+                        ctypes.byref(header),
+                        ctypes.sizeof(header)
+                    )
+        if ret != MMSYSERR_NOERROR:
+            sys.exit('Error: waveOutUnprepareHeader failed with code 0x%x' % ret)
+
+    def close(self):
+        """ x. Close Sound Device """
+        # return the blocks still queued, they can not be unprepared while playing
+        self.winmm.waveOutReset(self.hwaveout)
+        for index in self.pending:
+            self._unprepare(self.headers[index])
+        super(WinmmBackend, self).close()
+        self.winmm.waveOutClose(self.hwaveout)
+        if self.hevent:
+            self.kernel32.CloseHandle(wintypes.HANDLE(self.hevent))
+            self.hevent = None
+        debug( "Default Wave Audio output device is closed" )
+
+
+class VirtualClock(object):
+    """Playback position of a headless backend, counted in sample frames"""
+    def __init__(self, sampleRate=44100):
+        self.sampleRate = sampleRate
+        self.frames = 0
+        self.started = None
+
+    def reset(self, sampleRate):
+        self.sampleRate = sampleRate
+        self.frames = 0
+        self.started = time.perf_counter()
+
+    def advance(self, frames):
+        self.frames += frames
+
+    def seconds(self):
+        """played audio duration"""
+        return self.frames / float(self.sampleRate)
+
+    def speed(self):
+        """how many times faster than real time the audio was played"""
+        wallTime = time.perf_counter() - self.started if self.started else 0
+        return self.seconds() / wallTime if wallTime else 0.0
+
+
+class NullBackend(AudioBackend):
+    """Discard audio data, blocks complete when the virtual clock reaches them.
+
+         With realtime=False (the default) a block is done as soon as it is
+         waited for, otherwise waitCompletion sleeps until the block would
+         have been played by a sound card."""
+    def __init__(self, blockCount=2, realtime=False):
+        super(NullBackend, self).__init__(blockCount)
+        self.realtime = realtime
+        self.clock = VirtualClock()
+        self.lengths = [0] * blockCount
+        self.deadlines = [0] * blockCount
+        self.bytesWritten = 0
+        self.deadline = 0
+
+    def setBlockCount(self, blockCount):
+        super(NullBackend, self).setBlockCount(blockCount)
+        grow = blockCount - len(self.lengths)
+        self.lengths += [0] * grow
+        self.deadlines += [0] * grow
+
+    def open(self, wavefx):
+        super(NullBackend, self).open(wavefx)
+        self.clock.reset(wavefx.SamplesPerSec)
+        self.deadline = self.clock.started
+
+    def _write(self, data, index):
+        length = len(data)
+        self.lengths[index] = length
+        self.blockSize = length
+        now = time.perf_counter()
+        if self.realtime and self.bytesWritten and now > self.deadline:
+            self.underruns += 1
+        # a device starts a block when the previous one is done
+        self.deadline = max(self.deadline, now) + length / float(self.wavefx.AvgBytesPerSec)
+        self.deadlines[index] = self.deadline
+        self.write(data)
+
+    def write(self, data):
+        self.bytesWritten += len(data)
+
+    def _waitDone(self, index, timeout):
+        if self.realtime:
+            delay = self.deadlines[index] - time.perf_counter()
+            if timeout is not None and delay > timeout:
+                time.sleep(timeout)
+                return False
+            if delay > 0:
+                time.sleep(delay)
+        self.clock.advance(self.lengths[index] // self.wavefx.nBlockAlign)
+        return True
+
+
+class FileBackend(NullBackend):
+    """Write the played blocks to a file, a .wav path gets a RIFF header,
+         any other path receives raw PCM data"""
+    def __init__(self, path, blockCount=2, realtime=False):
+        super(FileBackend, self).__init__(blockCount, realtime)
+        self.path = path
+        self.file = None
+        self.isWave = path.lower().endswith('.wav')
+
+    def open(self, wavefx):
+        super(FileBackend, self).open(wavefx)
+        if self.isWave:
+            self.file = wave.open(self.path, 'wb')
+            self.file.setnchannels(wavefx.nChannels)
+            self.file.setsampwidth(wavefx.wBitsPerSample // 8)
+            self.file.setframerate(wavefx.SamplesPerSec)
+        else:
+            self.file = open(self.path, 'wb')
+        debug("Output file %s is opened" % self.path)
+
+    def write(self, data):
+        self.bytesWritten += len(data)
+        if self.isWave:
+            self.file.writeframesraw(data)
+        else:
+            self.file.write(data)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+            debug("Output file %s is closed" % self.path)
+
+
+def createBackend(name=None, path=None, blockCount=2, realtime=False):
+    """Create a backend by name: 'winmm', 'null' or 'file'.
+
+         Without a name winmm is used on Windows and the null sink elsewhere,
+         a path selects the file sink."""
+    if name is None:
+        if path:
+            name = 'file'
+        elif sys.platform == 'win32':
+            name = 'winmm'
+        else:
+            name = 'null'
+    if name == 'winmm':
+        return WinmmBackend(blockCount)
+    if name == 'null':
+        return NullBackend(blockCount, realtime)
+    if name == 'file':
+        return FileBackend(path, blockCount, realtime)
+    raise ValueError('unknown audio backend %r' % name)
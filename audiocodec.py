@@ -0,0 +1,151 @@
+#!python3
+# -*- coding:utf-8 -*-
+"""
+Table driven, vectorized decoders of compressed telephony audio.
+
+G.711 mu-law and A-law samples are one byte each and are decoded by a
+lookup in a 256 entry table. IMA-ADPCM (WAV format tag 0x11) packs 4bit
+codes into blocks of nBlockAlign bytes that start with the first sample and
+the step index of every channel. The step index and the predicted sample
+each follow a clamped running sum of the codes; clamped additions compose
+into a clamped addition again, so both sums are computed as prefix scans
+over whole blocks at once instead of one sample at a time.
+
+decode() turns complete blocks into int16 frames and is used by
+audioconvert for files whose WAV format tag names a codec. Raw streams,
+e.g. audiosocket.SocketStream, are described with codecFormat():
+
+    >>> wavefx = codecFormat('mulaw', 8000)
+    >>> stream = audioconvert.ConvertingStream(SocketStream(), aw.wavefx, wavefx)
+"""
+
+import numpy as np
+import audiobackend
+
+WAVE_FORMAT_ALAW = 0x6
+WAVE_FORMAT_MULAW = 0x7
+WAVE_FORMAT_IMA_ADPCM = 0x11
+
+#: nBlockAlign of IMA-ADPCM per channel, 256 bytes hold 505 frames
+ADPCM_BLOCK = 256
+
+INDEX_TABLE = np.array([-1, -1, -1, -1, 2, 4, 6, 8] * 2, np.int32)
+STEP_TABLE = np.array([
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41,
+    45, 50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190,
+    209, 230, 253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724,
+    796, 876, 963, 1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272,
+    2499, 2749, 3024, 3327, 3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132,
+    7845, 8630, 9493, 10442, 11487, 12635, 13899, 15289, 16818, 18500,
+    20350, 22385, 24623, 27086, 29794, 32767], np.int32)
+
+
+def _mulawTable():
+    code = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (code >> 4) & 0x7
+    magnitude = (((code & 0x0F) << 3) + 0x84 << exponent) - 0x84
+    return np.where(code & 0x80, -magnitude, magnitude).astype(np.int16)
+
+
+def _alawTable():
+    code = np.arange(256, dtype=np.int32) ^ 0x55
+    exponent = (code >> 4) & 0x7
+    mantissa = code & 0x0F
+    magnitude = np.where(exponent == 0, (mantissa << 4) + 8, ((mantissa << 4) + 0x108) << np.maximum(exponent - 1, 0))
+    return np.where(code & 0x80, magnitude, -magnitude).astype(np.int16)
+
+MULAW_TABLE = _mulawTable()
+ALAW_TABLE = _alawTable()
+
+CODECS = {'mulaw': WAVE_FORMAT_MULAW, 'alaw': WAVE_FORMAT_ALAW, 'adpcm': WAVE_FORMAT_IMA_ADPCM}
+
+
+def isCompressed(wavefx):
+    return wavefx.wFormatTag in (WAVE_FORMAT_MULAW, WAVE_FORMAT_ALAW, WAVE_FORMAT_IMA_ADPCM)
+
+
+def framesPerBlock(wavefx):
+    """sample frames decoded from nBlockAlign bytes"""
+    if wavefx.wFormatTag == WAVE_FORMAT_IMA_ADPCM:
+        # a header of 4 bytes per channel holds the first frame
+        return (wavefx.nBlockAlign - 4 * wavefx.nChannels) * 2 // wavefx.nChannels + 1
+    return 1
+
+
+def codecFormat(codec, rate=8000, channels=1):
+    """WAVEFORMATEX of `codec`: 'mulaw', 'alaw' or 'adpcm'"""
+    if codec not in CODECS:
+        raise ValueError('unknown codec %r' % codec)
+    if codec == 'adpcm':
+        blockAlign = ADPCM_BLOCK * channels
+        wavefx = audiobackend.WAVEFORMATEX(WAVE_FORMAT_IMA_ADPCM, channels, rate, 0, blockAlign, 4, 2)
+        wavefx.AvgBytesPerSec = rate * blockAlign // framesPerBlock(wavefx)
+        return wavefx
+    return audiobackend.WAVEFORMATEX(CODECS[codec], channels, rate, rate * channels, channels, 8, 0)
+
+
+def decode(data, wavefx):
+    """int16 array (frames, channels) of the whole blocks of `data`"""
+    tag = wavefx.wFormatTag
+    if tag == WAVE_FORMAT_MULAW or tag == WAVE_FORMAT_ALAW:
+        codes = np.frombuffer(data, np.uint8, len(data) - len(data) % wavefx.nChannels)
+        table = MULAW_TABLE if tag == WAVE_FORMAT_MULAW else ALAW_TABLE
+        return table[codes].reshape(-1, wavefx.nChannels)
+    if tag == WAVE_FORMAT_IMA_ADPCM:
+        return decodeAdpcm(data, wavefx)
+    raise ValueError('can not decode %s' % audiobackend.describeFormat(wavefx))
+
+
+def clampedScan(offsets, low, high, initial):
+    """Running clamp(x + offset, low, high) along the last axis of
+         `offsets` starting from `initial`, returns the value before every
+         addition (an exclusive scan).
+
+         clamp(clamp(x + a1, L1, H1) + a2, L2, H2) is clamp(x + a1 + a2, L,
+         H) with L, H the bounds L1 + a2, H1 + a2 clamped to L2..H2, so the
+         prefixes are composed by doubling in log2(n) vectorized passes."""
+    add = offsets.astype(np.int32)
+    lows = np.full(add.shape, low, np.int32)
+    highs = np.full(add.shape, high, np.int32)
+    shift = 1
+    while shift < add.shape[-1]:
+        # compose element i with the prefix ending at i - shift
+        a2, l2, h2 = add[..., shift:], lows[..., shift:], highs[..., shift:]
+        lows1 = np.clip(lows[..., :-shift] + a2, l2, h2)
+        highs1 = np.clip(highs[..., :-shift] + a2, l2, h2)
+        add[..., shift:] = add[..., :-shift] + a2
+        lows[..., shift:] = lows1
+        highs[..., shift:] = highs1
+        shift *= 2
+    initial = np.asarray(initial, np.int32)[..., np.newaxis]
+    inclusive = np.clip(initial + add, lows, highs)
+    return np.concatenate((initial, inclusive[..., :-1]), axis=-1)
+
+
+def decodeAdpcm(data, wavefx):
+    """int16 frames of the whole IMA-ADPCM blocks of `data`"""
+    channels = wavefx.nChannels
+    align = wavefx.nBlockAlign
+    blocks = len(data) // align
+    perBlock = framesPerBlock(wavefx)
+    raw = np.frombuffer(data, np.uint8, blocks * align).reshape(blocks, align)
+    header = raw[:, :4 * channels].reshape(blocks, channels, 4)
+    first = header[:, :, :2].copy().view('<i2')[:, :, 0].astype(np.int32)
+    index = np.minimum(header[:, :, 2], 88).astype(np.int32)
+    # 4 bytes (8 codes) of every channel in turn, low nibble first
+    body = raw[:, 4 * channels:].reshape(blocks, -1, channels, 4).transpose(0, 2, 1, 3).reshape(blocks, channels, -1)
+    codes = np.empty(body.shape[:2] + (body.shape[2] * 2,), np.int32)
+    codes[..., 0::2] = body & 0x0F
+    codes[..., 1::2] = body >> 4
+    steps = STEP_TABLE[clampedScan(INDEX_TABLE[codes], 0, 88, index)]
+    diff = steps >> 3
+    diff += np.where(codes & 4, steps, 0)
+    diff += np.where(codes & 2, steps >> 1, 0)
+    diff += np.where(codes & 1, steps >> 2, 0)
+    diff = np.where(codes & 8, -diff, diff)
+    samples = np.empty((blocks, channels, perBlock), np.int16)
+    samples[..., 0] = first
+    predicted = clampedScan(diff, -32768, 32767, first)
+    samples[..., 1:-1] = predicted[..., 1:]
+    samples[..., -1] = np.clip(predicted[..., -1] + diff[..., -1], -32768, 32767)
+    return samples.transpose(0, 2, 1).reshape(-1, channels)
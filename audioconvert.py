@@ -0,0 +1,218 @@
+#!python3
+# -*- coding:utf-8 -*-
+"""
+Streaming, vectorized PCM format conversion.
+
+FormatConverter turns blocks of one WAVEFORMATEX format into 16bit PCM of
+another: 8/16/24/32bit integer, 32/64bit float, G.711 and IMA-ADPCM
+(audiocodec module) samples are decoded,
+channels are up or down mixed and the sample rate is converted. The
+resampler interpolates linearly between input frames and low-pass filters
+at the higher of both rates, its filter history and fractional position are
+carried from block to block, so any block sizes give the same output as
+converting the whole file at once.
+
+ConvertingStream wraps a readable stream and looks like a stream of the
+target format, which lets mixed-format inputs feed one device or mixer:
+
+    >>> stream = ConvertingStream(wavfile.openReader('voice8k.wav'), mixer.wavefx)
+    >>> stream.readinto(buffer)     # 44.1kHz stereo 16bit
+"""
+
+import numpy as np
+import audiobackend
+import audiocodec
+
+WAVE_FORMAT_IEEE_FLOAT = 0x3
+
+#: taps of the low-pass filter of the resampler
+FILTER_TAPS = 63
+
+
+def pcmFormat(rate, channels, bits=16):
+    """WAVEFORMATEX of integer PCM"""
+    blockAlign = channels * bits // 8
+    return audiobackend.WAVEFORMATEX(audiobackend.WAVE_FORMAT_PCM, channels, rate,
+                                     rate * blockAlign, blockAlign, bits, 0)
+
+
+def isInt16(wavefx):
+    return wavefx.wFormatTag == audiobackend.WAVE_FORMAT_PCM and wavefx.wBitsPerSample == 16
+
+
+def decode(data, wavefx):
+    """float32 array (frames, channels) in [-1, 1) of bytes-like `data`"""
+    if audiocodec.isCompressed(wavefx):
+        return audiocodec.decode(data, wavefx).astype(np.float32) / 32768
+    bits = wavefx.wBitsPerSample
+    frames = len(data) // wavefx.nBlockAlign
+    count = frames * wavefx.nChannels
+    if wavefx.wFormatTag == WAVE_FORMAT_IEEE_FLOAT:
+        samples = np.frombuffer(data, np.float32 if bits == 32 else np.float64, count).astype(np.float32)
+    elif bits == 8:
+        # 8bit PCM is unsigned
+        samples = (np.frombuffer(data, np.uint8, count).astype(np.float32) - 128) / 128
+    elif bits == 16:
+        samples = np.frombuffer(data, np.int16, count).astype(np.float32) / 32768
+    elif bits == 24:
+        packed = np.frombuffer(data, np.uint8, count * 3).reshape(count, 3).astype(np.int32)
+        value = packed[:, 0] | (packed[:, 1] << 8) | (packed[:, 2] << 16)
+        samples = ((value << 8) >> 8).astype(np.float32) / (1 << 23) # sign extend
+    elif bits == 32:
+        samples = np.frombuffer(data, np.int32, count).astype(np.float32) / (1 << 31)
+    else:
+        raise ValueError('can not decode %s' % audiobackend.describeFormat(wavefx))
+    return samples.reshape(frames, wavefx.nChannels)
+
+
+def encodeInt16(frames):
+    """interleaved int16 samples of float `frames`, clipped to full scale"""
+    return np.clip(np.rint(frames * 32768), -32768, 32767).astype(np.int16).ravel()
+
+
+def toInt16(data, wavefx):
+    """int16 samples of `data`, a zero-copy view for 16bit PCM"""
+    if isInt16(wavefx):
+        return np.frombuffer(data, np.int16, len(data) // 2)
+    if audiocodec.isCompressed(wavefx):
+        return audiocodec.decode(data, wavefx).ravel()
+    return encodeInt16(decode(data, wavefx))
+
+
+def channelMatrix(sourceChannels, targetChannels):
+    """mixing matrix (source, target): mono is copied to all channels, all
+         channels are averaged to mono, otherwise channel i feeds channel i"""
+    if sourceChannels == 1:
+        return np.ones((1, targetChannels), np.float32)
+    if targetChannels == 1:
+        return np.full((sourceChannels, 1), 1.0 / sourceChannels, np.float32)
+    matrix = np.zeros((sourceChannels, targetChannels), np.float32)
+    for i in range(targetChannels):
+        matrix[i % sourceChannels, i] = 1
+    return matrix
+
+
+class LowPass(object):
+    """Streaming windowed-sinc FIR low-pass, `cutoff` relative to the
+         Nyquist frequency, keeps the last taps-1 frames between blocks"""
+    def __init__(self, cutoff, channels, taps=FILTER_TAPS):
+        n = np.arange(taps) - (taps - 1) / 2.0
+        kernel = cutoff * np.sinc(cutoff * n) * np.blackman(taps)
+        self.kernel = (kernel / kernel.sum()).astype(np.float32)
+        self.history = np.zeros((taps - 1, channels), np.float32)
+
+    def process(self, frames):
+        buffer = np.concatenate((self.history, frames))
+        self.history = buffer[len(buffer) - len(self.history):]
+        output = np.empty_like(frames)
+        for c in range(frames.shape[1]):
+            output[:, c] = np.convolve(buffer[:, c], self.kernel, 'valid')
+        return output
+
+
+class Resampler(object):
+    """Streaming linear interpolation from `sourceRate` to `targetRate`,
+         anti-aliased (down) or anti-imaged (up) by a LowPass at the higher
+         rate"""
+    def __init__(self, sourceRate, targetRate, channels):
+        self.step = sourceRate / float(targetRate)
+        cutoff = 0.9 * min(sourceRate, targetRate) / float(max(sourceRate, targetRate))
+        self.preFilter = LowPass(cutoff, channels) if self.step > 1 else None
+        self.postFilter = LowPass(cutoff, channels) if self.step < 1 else None
+        #: last input frame, the next output frames are interpolated from it
+        self.last = None
+        #: position of the next output frame relative to self.last
+        self.position = 0.0
+
+    def process(self, frames):
+        if self.preFilter:
+            frames = self.preFilter.process(frames)
+        if self.last is not None:
+            frames = np.concatenate((self.last, frames))
+        if len(frames) < 2:
+            self.last = frames
+            return np.zeros((0, frames.shape[1]), np.float32)
+        count = int(np.floor((len(frames) - 1 - self.position) / self.step)) + 1
+        if count <= 0:
+            self.position -= len(frames) - 1
+            self.last = frames[-1:]
+            return np.zeros((0, frames.shape[1]), np.float32)
+        times = self.position + np.arange(count) * self.step
+        index = np.minimum(times.astype(np.intp), len(frames) - 2)
+        fraction = (times - index).astype(np.float32)[:, np.newaxis]
+        output = frames[index] * (1 - fraction) + frames[index + 1] * fraction
+        self.position = times[-1] + self.step - (len(frames) - 1)
+        self.last = frames[-1:]
+        if self.postFilter:
+            output = self.postFilter.process(output)
+        return output
+
+
+class FormatConverter(object):
+    """Convert blocks in `source` format to 16bit PCM in `target` format.
+
+         Blocks need not be frame aligned, a partial frame is kept until the
+         next block."""
+    def __init__(self, source, target):
+        self.source = source
+        self.target = target
+        if not isInt16(target):
+            raise ValueError('can only convert to 16bit PCM, not %s' % audiobackend.describeFormat(target))
+        self.matrix = None
+        if source.nChannels != target.nChannels:
+            self.matrix = channelMatrix(source.nChannels, target.nChannels)
+        self.resampler = None
+        if source.SamplesPerSec != target.SamplesPerSec:
+            self.resampler = Resampler(source.SamplesPerSec, target.SamplesPerSec, target.nChannels)
+        self.rest = b''
+
+    def convert(self, data):
+        """int16 samples of the target format converted from `data`"""
+        if self.rest:
+            data = self.rest + bytes(data)
+        usable = len(data) - len(data) % self.source.nBlockAlign
+        self.rest = bytes(data[usable:])
+        data = memoryview(data)[:usable]
+        if self.matrix is None and self.resampler is None:
+            return toInt16(data, self.source)
+        frames = decode(data, self.source)
+        if self.matrix is not None:
+            frames = frames.dot(self.matrix)
+        if self.resampler:
+            frames = self.resampler.process(frames)
+        return encodeInt16(frames)
+
+
+class ConvertingStream(object):
+    """Readable stream of `target` format over `stream` holding data in
+         `source` format (the wavefx of the stream if None)"""
+    def __init__(self, stream, target, source=None):
+        self.stream = stream
+        self.wavefx = target
+        self.converter = FormatConverter(source or stream.wavefx, target)
+        #: bytes read from the stream per conversion
+        self.chunkSize = 16 * 2**10
+        self.samples = np.zeros(0, np.int16)
+        self.eof = False
+
+    def readinto(self, buffer):
+        """fill `buffer` with converted data, shorter only at end of stream"""
+        buffer = memoryview(buffer).cast('B')
+        wanted = len(buffer) // 2
+        while len(self.samples) < wanted and not self.eof:
+            data = self.stream.read(self.chunkSize)
+            if not data:
+                self.eof = True
+                break
+            self.samples = np.concatenate((self.samples, self.converter.convert(data)))
+        count = min(wanted, len(self.samples))
+        buffer[:count * 2] = self.samples[:count].view(np.uint8)
+        self.samples = self.samples[count:]
+        return count * 2
+
+    def read(self, size):
+        buffer = bytearray(size)
+        return bytes(buffer[:self.readinto(buffer)])
+
+    def close(self):
+        self.stream.close()
@@ -0,0 +1,231 @@
+#!python3
+# -*- coding:utf-8 -*-
+"""
+Qt-free playback core.
+
+AudioWriter reads a wave or raw PCM file and plays it through an
+audiobackend on a thread of its own. Block levels reach the caller through
+plain callbacks or an audiometer.MeterTable, so batch workers and servers
+use the writer without importing Qt; pyqtAudioWriter adapts it to a Qt
+signal for the GUI:
+
+    >>> aw = AudioWriter(audiobackend.NullBackend())
+    >>> aw.addObserver(lambda peak: print(peak))
+    >>> aw.open('sample.wav')
+    >>> aw.start()
+"""
+
+import time
+import threading
+import audiobackend
+import audiometer
+import wavfile
+import audioconvert
+import audiostats
+import latency
+
+DEBUG = False
+def debug(msg, *args):
+    """print `msg` % `args`, formatted only if DEBUG is on"""
+    if DEBUG:
+        print("debug: %s" % (msg % args if args else msg))
+
+
+class AudioWriter(threading.Thread):
+    """Play one file through an output backend on a thread of its own.
+
+         The peak of every block is stored in the audiometer.MeterTable
+         `meters` (slot `slot`) if set, otherwise every observer added by
+         addObserver() is called with it from the playback thread. A
+         masterclock.MasterClock set as `clock` (MasterClock.add) aligns
+         the start, pause and stop of this writer with other writers."""
+    def __init__(self, backend=None, blockCount=2):
+        """`backend` is an audiobackend.AudioBackend, by default the sound
+             card on Windows and a null sink on other platforms with a ring
+             of `blockCount` blocks"""
+        super(AudioWriter, self).__init__()
+        self._isPlaying = False
+        self.stopping = False
+        self.playEvent = threading.Event()
+        self.playEvent.set()
+        self.lockPlay = threading.Lock()
+        self.lockStop = threading.Lock()
+        self.backend = backend or audiobackend.createBackend(blockCount=blockCount)
+        self.wavefx = audiobackend.defaultFormat()
+        #: audiometer.MeterTable receiving the block peaks in slot `slot`
+        #: instead of the observers, writers may share one table
+        self.meters = None
+        self.observers = []
+        self.slot = 0
+        #: audiostats.PlaybackStats collecting metrics of run() if set
+        self.stats = None
+        self.clock = None
+        #: latency profile applied by open(): 'low', 'balanced', 'safe' or
+        #: 'auto', None keeps BUFSIZE and the ring of the backend
+        self.latency = None
+        self.tuner = None
+
+        #: configurable size of chunks (data blocks) read from input stream
+        self.BUFSIZE = 40*2**10
+        self.BYTESPERSEC = self.wavefx.AvgBytesPerSec
+
+    def open(self, file, wavefx=None):
+        """ 1. Open output device, tune it for the incoming data flow
+
+             The device format is taken from the wave file, raw PCM files
+             are expected in audiobackend.defaultFormat(). Samples other
+             than 16bit PCM are converted to it, `wavefx` resamples and
+             remixes the file to another device format
+        """
+        self.file = file
+        self.stream = wavfile.openReader(file)
+        source = self.stream.wavefx
+        if wavefx is None and not audioconvert.isInt16(source):
+            wavefx = audioconvert.pcmFormat(source.SamplesPerSec, source.nChannels)
+        if wavefx is not None:
+            self.stream = audioconvert.ConvertingStream(self.stream, wavefx)
+        self.wavefx = self.stream.wavefx
+        self.BYTESPERSEC = self.wavefx.AvgBytesPerSec
+        self.tuner = latency.configure(self)
+        self.backend.open(self.wavefx)
+
+    def addObserver(self, callback):
+        """call `callback(peak)` with the peak of every played block"""
+        self.observers.append(callback)
+
+    def removeObserver(self, callback):
+        self.observers.remove(callback)
+
+    def isPlaying(self):
+        isPlaying = False
+        self.lockPlay.acquire()
+        isPlaying = self._isPlaying
+        self.lockPlay.release()
+        return isPlaying
+
+    def pause(self):
+        self.playEvent.clear()
+
+    def resume(self):
+        self.playEvent.set()
+
+    def stop(self):
+        self.lockStop.acquire()
+        self.stopping = True
+        self.lockStop.release()
+
+    def run(self):
+        """Read PCM audio blocks from stream and write to the output device
+
+             Blocks are zero-copy slices of the memory mapped file, shared
+             with the meter and the device. Converted data is read into a
+             ring of preallocated buffers instead. Playback stops at the end
+             of the audio data
+        """
+        stream = self.stream
+        clock = self.clock
+        tuner = self.tuner
+        align = self.wavefx.nBlockAlign
+        lengths = [0] * self.backend.blockCount  #: frames of the queued blocks
+        stats = self.stats
+        timer = audiostats.timer
+        cpu = time.thread_time()
+        buffers = [bytearray(self.BUFSIZE) for i in range(self.backend.blockCount)]
+        stopping = False  #: stopping playback when no input
+        prevlen  = 0      #: previously read length to detect buffer underruns
+        maxValue = 0
+        self.lockPlay.acquire()
+        self._isPlaying = True
+        self.lockPlay.release()
+        if clock:
+            clock.ready(self)
+        while True:
+            self.playEvent.wait()
+            freeids = self.backend.freeBlocks()
+            self.lockStop.acquire()
+            stopping = self.stopping
+            self.lockStop.release()
+            if stopping:
+                break
+            debug("empty blocks %s", freeids)
+
+            # Fill audio queue
+            for i in freeids:
+                if stopping:
+                    break
+                debug("scheduling block %d", i)
+                if stats:
+                    started = timer()
+                blockSize = tuner.blockSize if tuner else self.BUFSIZE
+                size = blockSize
+                if clock:
+                    # blocks end on the pause and stop frames of the clock
+                    size = clock.allowance(self, size // align) * align
+                data = self._read_block(stream, buffers[i], size)
+                readlen = len(data)
+                if clock:
+                    clock.advance(self, readlen // align)
+                if readlen == 0:
+                    # let the queued blocks play out
+                    while True:
+                        done = self.backend.waitCompletion()
+                        if done is None:
+                            break
+                        if clock:
+                            clock.complete(self, lengths[done])
+                    self.stop()
+                    break
+                if size == blockSize and prevlen < blockSize and readlen < blockSize:
+                    debug("  underrun warn - read %s/%s (%d%%) of buffer size",
+                          readlen, blockSize, readlen*100//blockSize)
+                    if stats:
+                        stats.count('underruns')
+                if stats:
+                    metered = timer()
+                maxValue = audiometer.blockPeak(data, self.wavefx.nChannels)
+                if stats:
+                    stats.observe('meter', timer() - metered)
+                debug("block max num    %s", maxValue)
+                if self.meters is not None:
+                    self.meters.set(self.slot, maxValue)
+                else:
+                    for observer in self.observers:
+                        observer(maxValue)
+                self.backend.scheduleBlock(data, i)
+                lengths[i] = readlen // align
+                if tuner:
+                    tuner.update(self.backend.underruns, readlen)
+                if stats:
+                    stats.observe('schedule', timer() - started)
+                    stats.count('blocks')
+                    stats.count('bytes', readlen)
+
+            # sleep until the device is done with a block
+            if stats:
+                started = timer()
+            done = self.backend.waitCompletion()
+            if stats:
+                stats.observe('wait', timer() - started)
+            if clock and done is not None:
+                clock.complete(self, lengths[done])
+            debug("block %s is done", done)
+            prevlen = readlen
+        if stats:
+            stats.count('cpu', time.thread_time() - cpu)
+        if clock:
+            clock.finish(self)
+        stream.close()
+        self.stopping = False
+        self.lockPlay.acquire()
+        self._isPlaying = False
+        self.lockPlay.release()
+
+    def _read_block(self, stream, buffer, size):
+        if isinstance(stream, wavfile.PcmReader):
+            return stream.block(size)
+        return memoryview(buffer)[:stream.readinto(memoryview(buffer)[:size])]
+
+    def close(self):
+        """ x. Close output device """
+        self.backend.close()
+
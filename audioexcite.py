@@ -0,0 +1,176 @@
+#!python3
+# -*- coding:utf-8 -*-
+"""
+Offline audio excitation (语音激励) of time aligned recordings.
+
+For every window of the recordings the stream with the greatest average
+block peak is selected, the same decision Dialog.caculate makes while the
+files play, but computed from memory mapped files as fast as the disks and
+CPUs allow. Files are cut into segments of whole windows which are measured
+by a process pool, the selected stream of every window is written as CSV or
+JSON timeline:
+
+    python audioexcite.py a.wav b.wav c.wav --window 2 -o timeline.csv
+
+With --cache the levels come from the level pyramids of levelcache, built
+on the first run and read without touching the audio on later ones. Block
+and window bounds are then rounded to levelcache.BASE_FRAMES frames.
+"""
+
+import sys
+import json
+import argparse
+import itertools
+import concurrent.futures
+import numpy as np
+import audiometer
+import audioconvert
+import levelcache
+import wavfile
+
+DEBUG = False
+def debug(msg, *args):
+    """print `msg` % `args`, formatted only if DEBUG is on"""
+    if DEBUG:
+        print("debug: %s" % (msg % args if args else msg))
+
+#: audio measured by one task of the process pool, in seconds
+SEGMENT_SECONDS = 600
+#: audio measured at a time inside a task, bounds the memory of a worker
+CHUNK_SECONDS = 60
+
+
+def segmentLevels(path, firstWindow, windowCount, window, block):
+    """Average block peak of `windowCount` windows starting at window
+         `firstWindow` of file `path`. `window` and `block` are seconds.
+         Windows past the end of file are left out of the result."""
+    reader = wavfile.openReader(path)
+    try:
+        wavefx = reader.wavefx
+        windowFrames = int(window * wavefx.SamplesPerSec)
+        blockFrames = int(block * wavefx.SamplesPerSec)
+        channels = wavefx.nChannels
+        align = wavefx.nBlockAlign
+        perBlock = reader.framesPerBlock
+        frames = min(reader.frames(), (firstWindow + windowCount) * windowFrames)
+        levels = []
+        chunkWindows = max(1, int(CHUNK_SECONDS // window))
+        start = firstWindow * windowFrames
+        while start < frames:
+            count = min(chunkWindows, (frames - start) // windowFrames)
+            if count:
+                end = start + count * windowFrames
+            else:
+                # the last window of the file is shorter
+                end = frames
+                count = 1
+            # zero-copy for 16bit PCM, other sample formats are converted;
+            # compressed files are decoded in whole blocks and trimmed
+            first = start // perBlock
+            last = -(-end // perBlock)
+            samples = audioconvert.toInt16(reader.data[first * align:last * align], wavefx)
+            skip = (start - first * perBlock) * channels
+            chunk = samples[skip:skip + (end - start) * channels].reshape(count, -1)
+            peak = audiometer.measure(chunk, channels, blockFrames).peak
+            levels.append(peak.max(axis=2).mean(axis=1))
+            start = end
+        return np.concatenate(levels) if levels else np.zeros(0)
+    finally:
+        reader.close()
+
+
+def selectLoudest(levels):
+    """Index of the loudest stream for each row of `levels` (windows x
+         streams, NaN for streams that already ended). Like
+         Dialog.caculate the first stream wins ties and silent windows."""
+    levels = np.where(np.isnan(levels), -1, levels)
+    selected = levels.argmax(axis=1)
+    selected[levels.max(axis=1) <= 0] = 0
+    return selected
+
+
+def analyze(paths, window=2.0, block=0.1, workers=None, cache=None):
+    """Measure all files and return (levels, selected), levels has one row
+         per window and one column per file. The levels are taken from the
+         pyramids of `cache`, a levelcache.LevelCache, if given."""
+    if cache is not None:
+        missing = [it for it in paths if cache.get(it, build=False) is None]
+        if missing:
+            # the pyramids are built by the pool and read back from disk
+            with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+                for path in executor.map(buildPyramid, itertools.repeat(cache.directory),
+                                         itertools.repeat(cache.maxBytes), missing):
+                    debug("%s analyzed", path)
+        return tabulate([cache.get(it).windowLevels(window, block) for it in paths])
+    tasks = []
+    for (index, path) in enumerate(paths):
+        reader = wavfile.openReader(path)
+        windowCount = int(np.ceil(reader.duration() / window))
+        reader.close()
+        segment = max(1, int(SEGMENT_SECONDS // window))
+        for first in range(0, windowCount, segment):
+            tasks.append((index, path, first, min(segment, windowCount - first)))
+    columns = [[] for it in paths]
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        results = executor.map(segmentLevels,
+                               [it[1] for it in tasks], [it[2] for it in tasks], [it[3] for it in tasks],
+                               itertools.repeat(window), itertools.repeat(block))
+        for (task, result) in zip(tasks, results):
+            columns[task[0]].append(result)
+            debug("%s windows %d-%d measured", task[1], task[2], task[2] + task[3])
+    return tabulate([np.concatenate(it) if it else np.zeros(0) for it in columns])
+
+
+def buildPyramid(directory, maxBytes, path):
+    """store the level pyramid of `path` in the cache `directory`"""
+    levelcache.LevelCache(directory, maxBytes).get(path)
+    return path
+
+
+def tabulate(columns):
+    """(levels, selected) of the window levels of every file"""
+    windowCount = max([len(it) for it in columns] or [0])
+    levels = np.full((windowCount, len(columns)), np.nan)
+    for (index, it) in enumerate(columns):
+        levels[:len(it), index] = it
+    return levels, selectLoudest(levels)
+
+
+def writeTimeline(output, paths, levels, selected, window, format):
+    if format == 'json':
+        timeline = [{'start': i * window, 'end': (i + 1) * window,
+                     'selected': int(it) + 1, 'file': paths[it],
+                     'levels': [None if np.isnan(v) else round(float(v), 1) for v in levels[i]]}
+                    for (i, it) in enumerate(selected)]
+        json.dump({'files': paths, 'window': window, 'timeline': timeline}, output, indent=1)
+        output.write('\n')
+        return
+    output.write('start,end,selected,file,%s\n' % ','.join('level%d' % (i + 1) for i in range(len(paths))))
+    for (i, it) in enumerate(selected):
+        output.write('%.3f,%.3f,%d,%s,%s\n' % (i * window, (i + 1) * window, it + 1, paths[it],
+                     ','.join('' if np.isnan(v) else '%.1f' % v for v in levels[i])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Select the loudest of time aligned recordings for every window')
+    parser.add_argument('files', nargs='+', help='wav or pcm files')
+    parser.add_argument('-w', '--window', type=float, default=2.0, help='selection window in seconds (default 2)')
+    parser.add_argument('-b', '--block', type=float, default=0.1, help='metering block in seconds (default 0.1)')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default CPU count)')
+    parser.add_argument('-f', '--format', choices=('csv', 'json'), help='timeline format, by default taken from output name')
+    parser.add_argument('-o', '--output', help='timeline file (default stdout)')
+    parser.add_argument('-c', '--cache', nargs='?', const='', default=None, metavar='DIR',
+                        help='use the level cache (default directory %s)' % levelcache.defaultDirectory())
+    args = parser.parse_args(argv)
+    format = args.format or ('json' if args.output and args.output.lower().endswith('.json') else 'csv')
+    cache = None if args.cache is None else levelcache.LevelCache(args.cache or None)
+    levels, selected = analyze(args.files, args.window, args.block, args.workers, cache)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8', newline='') as output:
+            writeTimeline(output, args.files, levels, selected, args.window, format)
+    else:
+        writeTimeline(sys.stdout, args.files, levels, selected, args.window, format)
+
+
+if __name__ == '__main__':
+    main()
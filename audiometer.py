@@ -0,0 +1,154 @@
+#!python3
+# -*- coding:utf-8 -*-
+"""
+Vectorized level metering of 16bit PCM blocks.
+
+measure() works on a zero-copy int16 view of the audio data. Its input may
+be a single block (1-D) or a batch of blocks with one row per stream (2-D),
+and it returns peak and RMS levels per stream, per sub-window and per
+channel in one call:
+
+    >>> samples = samplesOf(data)              # no copy of data
+    >>> levels = measure(samples, channels=2, windowFrames=441)
+    >>> levels.peak.shape                      # (windows, channels)
+    >>> dbfs(levels.rms)
+
+MeterTable hands the levels of many streams from the audio thread to the
+GUI without a signal per block.
+"""
+
+import time
+import threading
+import collections
+import numpy as np
+
+FULL_SCALE = 1 << 15   # int16 full scale
+MIN_DBFS = -96.0       # reported for digital silence
+
+#: peak and rms have shape (streams, windows, channels) for batched input
+#: and (windows, channels) for a single block
+Levels = collections.namedtuple('Levels', 'peak rms')
+
+
+def samplesOf(data):
+    """int16 view of bytes-like `data`, trailing odd byte is ignored"""
+    return np.frombuffer(data, np.int16, len(data) // 2)
+
+
+def measure(samples, channels=1, windowFrames=0):
+    """Peak absolute value and RMS of int16 `samples`.
+
+         The last axis of `samples` holds interleaved frames of `channels`
+         samples, it is split into windows of `windowFrames` frames (0 means
+         one window for the whole block). Frames following the last whole
+         window form a shorter window of their own."""
+    samples = np.asarray(samples)
+    frames = samples.shape[-1] // channels
+    if not windowFrames or windowFrames > frames:
+        windowFrames = frames
+    if frames == 0:
+        shape = samples.shape[:-1] + (0, channels)
+        return Levels(np.zeros(shape, np.int32), np.zeros(shape, np.float32))
+    windows = frames // windowFrames
+    used = windows * windowFrames * channels
+    levels = _measure(samples[..., :used], windows, windowFrames, channels)
+    rest = frames - windows * windowFrames
+    if rest:
+        tail = _measure(samples[..., used:used + rest * channels], 1, rest, channels)
+        levels = Levels(np.concatenate((levels.peak, tail.peak), axis=-2),
+                        np.concatenate((levels.rms, tail.rms), axis=-2))
+    return levels
+
+
+def _measure(samples, windows, windowFrames, channels):
+    view = samples.reshape(samples.shape[:-1] + (windows, windowFrames, channels))
+    # abs(-32768) does not fit int16, take the peak from both extremes
+    peak = np.maximum(view.max(axis=-2).astype(np.int32), -view.min(axis=-2).astype(np.int32))
+    floats = view.astype(np.float32)
+    rms = np.sqrt(np.einsum('...ij,...ij->...j', floats, floats) / windowFrames)
+    return Levels(peak, rms)
+
+
+def dbfs(values):
+    """Convert levels to dB relative to full scale, silence is MIN_DBFS"""
+    values = np.asarray(values, np.float64)
+    with np.errstate(divide='ignore'):
+        db = 20 * np.log10(values / FULL_SCALE)
+    return np.maximum(db, MIN_DBFS)
+
+
+def blockPeak(data, channels=1):
+    """Peak absolute value of a PCM block over all channels"""
+    peak = measure(samplesOf(data), channels).peak
+    return int(peak.max()) if peak.size else 0
+
+
+#: copies of the MeterTable arrays taken by MeterTable.snapshot
+MeterSnapshot = collections.namedtuple('MeterSnapshot', 'sequence peak rms peakSums windows')
+
+
+class MeterTable(object):
+    """Levels of `size` streams, one slot per stream.
+
+         Audio threads write the latest block levels with update() or
+         set(), the GUI reads them with snapshot() at its own refresh rate,
+         so its cost does not depend on the number of blocks. Readers take
+         no lock: a writer makes `sequence` odd while it writes and readers
+         retry a copy that overlapped a write. Writers are serialized by
+         `lock`, so several writer threads can share a table. Window peaks are
+         accumulated and never reset, averagePeaks() of two snapshots gives
+         the average of the windows in between."""
+    def __init__(self, size):
+        self.peak = np.zeros(size, np.int32)
+        self.rms = np.zeros(size, np.float32)
+        self.peakSums = np.zeros(size, np.float64)
+        self.windows = np.zeros(size, np.int64)
+        self.sequence = 0
+        # an unsynchronized sequence += 1 of two writers could leave it odd
+        # for good and snapshot() spinning
+        self.lock = threading.Lock()
+
+    def update(self, levels):
+        """store batched Levels, one row per slot"""
+        peaks = levels.peak.max(axis=-1) # (streams, windows) over all channels
+        if not peaks.shape[1]:
+            return
+        peak = peaks.max(axis=1)
+        rms = levels.rms.max(axis=(1, 2))
+        with self.lock:
+            self.sequence += 1
+            self.peak[:] = peak
+            self.rms[:] = rms
+            self.peakSums += peaks.sum(axis=1)
+            self.windows += peaks.shape[1]
+            self.sequence += 1
+
+    def set(self, slot, peak, rms=0.0):
+        """store the block levels of one stream"""
+        with self.lock:
+            self.sequence += 1
+            self.peak[slot] = peak
+            self.rms[slot] = rms
+            self.peakSums[slot] += peak
+            self.windows[slot] += 1
+            self.sequence += 1
+
+    def snapshot(self):
+        while True:
+            sequence = self.sequence
+            if not sequence & 1:
+                snapshot = MeterSnapshot(sequence, self.peak.copy(), self.rms.copy(),
+                                         self.peakSums.copy(), self.windows.copy())
+                if self.sequence == sequence:
+                    return snapshot
+            time.sleep(0)
+
+
+def averagePeaks(current, previous=None):
+    """average window peak of each stream between two MeterSnapshots,
+         NaN for streams without windows in between"""
+    sums, windows = current.peakSums, current.windows
+    if previous is not None:
+        sums, windows = sums - previous.peakSums, windows - previous.windows
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(windows > 0, sums / windows, np.nan)
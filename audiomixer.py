@@ -0,0 +1,347 @@
+#!python3
+# -*- coding:utf-8 -*-
+"""
+Single threaded multi-stream mixer.
+
+AudioMixer owns all input streams and one output backend. Every loop
+iteration reads one block from each input, measures the block levels of all
+inputs at once and either mixes all inputs or routes a single one to the
+output device, so the cost of a stream is one read and a few vectorized
+operations instead of a thread and a device handle.
+
+The output is 16bit PCM with the highest sample rate and channel count of
+the inputs unless `outputFormat` is set, inputs in other formats are
+converted block by block.
+"""
+
+import time
+import threading
+import numpy as np
+import audiobackend
+import audiometer
+import wavfile
+import audioconvert
+import audiostats
+import shardedmeter
+import latency
+import spectral
+
+DEBUG = False
+def debug(msg, *args):
+    """print `msg` % `args`, formatted only if DEBUG is on"""
+    if DEBUG:
+        print("debug: %s" % (msg % args if args else msg))
+
+
+class MixerInput(object):
+    """An input stream of the mixer, `stream` is anything with .readinto()
+         method carrying PCM data in format `wavefx`, by default the format
+         of a wavfile reader or audiobackend.defaultFormat()"""
+    def __init__(self, stream, name='', wavefx=None):
+        self.stream = stream
+        self.name = name
+        self.wavefx = wavefx or getattr(stream, 'wavefx', None) or audiobackend.defaultFormat()
+        self.finished = False
+
+    @classmethod
+    def fromFile(cls, path):
+        return cls(wavfile.openReader(path), path)
+
+    def readinto(self, buffer):
+        count = self.stream.readinto(buffer)
+        if not count:
+            self.finished = True
+        return count or 0
+
+    def close(self):
+        self.stream.close()
+
+
+class AudioMixer(threading.Thread):
+    """Play many input streams through one output backend from one thread.
+
+         The levels of all inputs, measured over windows of `meterFrames`
+         frames, are stored in the audiometer.MeterTable `meters` after
+         every block, finished inputs report 0. `onLevels` is called with
+         the audiometer.Levels of the block if set. If `excitation` holds
+         an excitation.ExcitationEngine it is fed with every window and
+         `selected` is its latest choice; the engine scores the window
+         peaks, or spectral.score() of the windows if `spectral` holds a
+         spectral.SpectralAnalyzer. Metrics of the loop go to the
+         audiostats.PlaybackStats `stats` if set, underruns count inputs
+         that delivered a short block after a short one, like the writers;
+         the last block of a file is not one. Output blocks and
+         selection changes are teed to the audiorecorder.Recorder
+         `recorder` if set, close() closes it. With `meterWorkers` > 0 the
+         inputs are metered by that many shardedmeter worker processes.
+         `route` selects the index of the only input sent to the output,
+         None mixes all of them. With `render` 'selected' only the input
+         chosen by the excitation engine, or the `topK` loudest inputs by
+         its smoothed levels, are mixed; a change of the rendered inputs
+         crossfades over `crossfade` seconds."""
+    def __init__(self, backend=None, blockCount=2):
+        super(AudioMixer, self).__init__()
+        self._isPlaying = False
+        self.stopping = False
+        self.playEvent = threading.Event()
+        self.playEvent.set()
+        self.lockPlay = threading.Lock()
+        self.lockStop = threading.Lock()
+        self.backend = backend or audiobackend.createBackend(blockCount=blockCount)
+        self.wavefx = audiobackend.defaultFormat()
+        self.outputFormat = None
+        self.inputs = []
+        self.route = None
+        self.render = 'mix'
+        self.topK = 1
+        self.crossfade = 0.02
+        self.rendered = ()   #: inputs rendered into the last block
+        self.fadingFrom = None   #: inputs faded out, None if no fade runs
+        self.fadePosition = 0    #: samples of fadeIn already applied
+        self.onLevels = None
+        self.stats = None
+        self.recorder = None
+        self.meterWorkers = 0
+        #: latency profile applied by open(), see latency module
+        self.latency = None
+        self.tuner = None
+        self.meterFrames = 0
+        self.excitation = None
+        self.selected = None
+        self.spectral = None
+
+        #: configurable size of chunks (data blocks) read from input streams
+        self.BUFSIZE = 40*2**10
+
+    def addInput(self, input):
+        """add a MixerInput or a file path, returns index of the input"""
+        if not isinstance(input, MixerInput):
+            input = MixerInput.fromFile(input)
+        self.inputs.append(input)
+        return len(self.inputs) - 1
+
+    def open(self):
+        """ 1. Open output device in the format of the inputs
+        """
+        if self.outputFormat:
+            self.wavefx = self.outputFormat
+        elif self.inputs:
+            self.wavefx = audioconvert.pcmFormat(max(it.wavefx.SamplesPerSec for it in self.inputs),
+                                                 max(it.wavefx.nChannels for it in self.inputs))
+        format = audiobackend.describeFormat(self.wavefx)
+        for it in self.inputs:
+            if audiobackend.describeFormat(it.wavefx) != format:
+                debug("converting %s from %s", it.name, audiobackend.describeFormat(it.wavefx))
+                it.stream = audioconvert.ConvertingStream(it.stream, self.wavefx, it.wavefx)
+                it.wavefx = self.wavefx
+        self.tuner = latency.configure(self)
+        self.backend.open(self.wavefx)
+        sampleCount = self.BUFSIZE // 2
+        #: one row of int16 samples per input, inputs read into it directly
+        self.blocks = np.zeros((len(self.inputs), sampleCount), np.int16)
+        self.lengths = np.zeros(len(self.inputs), np.intp)
+        self.mixed = np.zeros(sampleCount, np.int32)
+        #: one output block per device block, reused once the device is done
+        self.outputs = np.zeros((self.backend.blockCount, sampleCount), np.int16)
+        fadeFrames = max(1, int(self.crossfade * self.wavefx.SamplesPerSec))
+        #: gain of the new inputs for every sample of a crossfade
+        self.fadeIn = np.repeat(np.linspace(0, 1, fadeFrames, dtype=np.float32), self.wavefx.nChannels)
+        self.rendered = ()
+        self.fadingFrom = None
+        self.fadePosition = 0
+        self.meters = audiometer.MeterTable(len(self.inputs))
+
+    def isPlaying(self):
+        isPlaying = False
+        self.lockPlay.acquire()
+        isPlaying = self._isPlaying
+        self.lockPlay.release()
+        return isPlaying
+
+    def pause(self):
+        self.playEvent.clear()
+
+    def resume(self):
+        self.playEvent.set()
+
+    def stop(self):
+        self.lockStop.acquire()
+        self.stopping = True
+        self.lockStop.release()
+
+    def _read_blocks(self, samples=None):
+        """Read one block of up to `samples` samples of every input into
+             self.blocks, returns the number of samples of the longest block"""
+        for (i, it) in enumerate(self.inputs):
+            if it.finished:
+                # with meterWorkers the rows of every ring slot still hold
+                # the last block of the input
+                self.blocks[i, :samples] = 0
+                self.lengths[i] = 0
+                continue
+            count = it.readinto(memoryview(self.blocks[i, :samples]).cast('B')) // 2
+            self.blocks[i, count:samples] = 0
+            self.lengths[i] = count
+        return int(self.lengths.max()) if len(self.inputs) else 0
+
+    def _mix_block(self, count, index):
+        """Mix or route the first `count` samples of the input blocks into
+             output block `index`, returns the output as a byte buffer"""
+        output = self.outputs[index, :count]
+        route = self.route
+        if route is not None:
+            output[:] = self.blocks[route, :count]
+        elif self.render == 'selected':
+            mixed = self.mixed[:count]
+            rendered = self._rendered_inputs()
+            self._sum_inputs(rendered, count, mixed)
+            if rendered != self.rendered:
+                # a change during a fade starts a new one from the last inputs
+                debug("rendering inputs %s", rendered)
+                self.fadingFrom = self.rendered
+                self.fadePosition = 0
+                self.rendered = rendered
+            if self.fadingFrom is not None:
+                # fade from the previous inputs to the new ones, over as many
+                # blocks as the crossfade takes
+                start = self.fadePosition
+                fade = self.fadeIn[start:start + count]
+                previous = np.zeros(len(fade), np.int32)
+                self._sum_inputs(self.fadingFrom, len(fade), previous)
+                mixed[:len(fade)] = np.rint(previous + (mixed[:len(fade)] - previous) * fade)
+                self.fadePosition += len(fade)
+                if self.fadePosition >= len(self.fadeIn):
+                    self.fadingFrom = None
+            np.clip(mixed, -32768, 32767, out=mixed)
+            output[:] = mixed
+        else:
+            mixed = self.mixed[:count]
+            np.sum(self.blocks[:, :count], axis=0, dtype=np.int32, out=mixed)
+            np.clip(mixed, -32768, 32767, out=mixed)
+            output[:] = mixed
+        return memoryview(output).cast('B')
+
+    def _rendered_inputs(self):
+        """indexes of the inputs the 'selected' render mode plays"""
+        if self.topK > 1 and self.excitation:
+            loudest = np.argsort(-self.excitation.smoothed, kind='stable')[:self.topK]
+            return tuple(sorted(int(it) for it in loudest))
+        return () if self.selected is None else (self.selected,)
+
+    def _sum_inputs(self, indexes, count, out):
+        if not indexes:
+            out[:] = 0
+        elif len(indexes) == 1:
+            out[:] = self.blocks[indexes[0], :count]
+        else:
+            np.sum(self.blocks[list(indexes), :count], axis=0, dtype=np.int32, out=out)
+
+    def run(self):
+        """Read blocks of all inputs, report their levels and write the
+             mixed block to the output device until all inputs end"""
+        stopping = False  #: stopping playback when no input
+        stats = self.stats
+        timer = audiostats.timer
+        cpu = time.thread_time()
+        prevShort = np.zeros(len(self.inputs), bool)  #: inputs whose last block was short
+        sharded = None
+        if self.meterWorkers and self.inputs:
+            sharded = shardedmeter.ShardedMeter(len(self.inputs), self.blocks.shape[1], self.wavefx.nChannels,
+                                                self.meterFrames, self.meterWorkers)
+            slot = 0
+        self.lockPlay.acquire()
+        self._isPlaying = True
+        self.lockPlay.release()
+        while True:
+            self.playEvent.wait()
+            freeids = self.backend.freeBlocks()
+            self.lockStop.acquire()
+            stopping = self.stopping
+            self.lockStop.release()
+            if stopping:
+                break
+
+            # Fill audio queue
+            for i in freeids:
+                if stats:
+                    started = timer()
+                if sharded:
+                    self.blocks = sharded.blocks[slot]
+                requested = self.tuner.blockSize // 2 if self.tuner else self.blocks.shape[1]
+                count = self._read_blocks(requested)
+                if count == 0:
+                    # let the queued blocks play out
+                    while self.backend.waitCompletion() is not None:
+                        pass
+                    self.stop()
+                    break
+                if sharded:
+                    # the workers meter while this thread mixes
+                    sharded.submit(slot, count)
+                output = None
+                if self.render == 'mix':
+                    output = self._mix_block(count, i)
+                if stats:
+                    metered = timer()
+                if sharded:
+                    levels = sharded.collect(slot)
+                    slot = (slot + 1) % sharded.ringBlocks
+                else:
+                    levels = audiometer.measure(self.blocks[:, :count],
+                                                self.wavefx.nChannels, self.meterFrames)
+                if stats:
+                    stats.observe('meter', timer() - metered)
+                self.meters.update(levels)
+                if self.excitation:
+                    if self.spectral:
+                        peaks = spectral.score(self.spectral.measure(self.blocks[:, :count], self.meterFrames))
+                    else:
+                        peaks = levels.peak.max(axis=2) # (inputs, windows)
+                    for window in range(peaks.shape[1]):
+                        selected = self.excitation.update(peaks[:, window])
+                        if self.recorder and selected != self.selected:
+                            self.recorder.mark(selected, self.inputs[selected].name,
+                                               self.recorder.frames + window * self.meterFrames)
+                        self.selected = selected
+                if self.onLevels:
+                    self.onLevels(levels)
+                if output is None:
+                    # the selection of this block decides what is rendered
+                    output = self._mix_block(count, i)
+                self.backend.scheduleBlock(output, i)
+                if self.recorder:
+                    self.recorder.record(output)
+                if self.tuner:
+                    self.tuner.update(self.backend.underruns, count * 2)
+                if stats:
+                    stats.observe('schedule', timer() - started)
+                    stats.count('blocks')
+                    stats.count('bytes', count * 2)
+                    short = (self.lengths > 0) & (self.lengths < requested)
+                    stats.count('underruns', int((short & prevShort).sum()))
+                    prevShort = short
+
+            # sleep until the device is done with a block
+            if stats:
+                started = timer()
+            done = self.backend.waitCompletion()
+            if stats:
+                stats.observe('wait', timer() - started)
+            debug("block %s is done", done)
+        if stats:
+            stats.count('cpu', time.thread_time() - cpu)
+        if sharded:
+            self.blocks = self.blocks.copy()
+            sharded.close()
+        for it in self.inputs:
+            it.close()
+        self.stopping = False
+        self.lockPlay.acquire()
+        self._isPlaying = False
+        self.lockPlay.release()
+
+    def close(self):
+        """ x. Close output device """
+        self.backend.close()
+        if self.recorder:
+            self.recorder.close()
@@ -0,0 +1,144 @@
+#!python3
+# -*- coding:utf-8 -*-
+"""
+Asynchronous audit recorder of the played audio.
+
+Recorder takes copies of the blocks handed to the output device and writes
+them to a WAV or raw PCM file on a thread of its own, through large
+buffered writes. The playback thread only puts blocks into a bounded
+queue: when the disk falls behind and the queue is full, blocks are
+dropped and counted instead of stalling playback.
+
+Selection changes are written to a CSV sidecar with their sample offset in
+the played audio, dropped blocks are listed there too, so the recording
+can be matched with the playback timeline:
+
+    >>> mixer.recorder = Recorder('audit.wav', mixer.wavefx)
+    >>> mixer.recorder.start()
+    ...
+    >>> mixer.close()           # closes the recorder too
+    >>> mixer.recorder.stats()
+"""
+
+import os
+import csv
+import queue
+import wave
+import threading
+import collections
+
+DEBUG = False
+def debug(msg, *args):
+    """print `msg` % `args`, formatted only if DEBUG is on"""
+    if DEBUG:
+        print("debug: %s" % (msg % args if args else msg))
+
+#: buffer of the file writes
+BUFFER_SIZE = 1 << 20
+
+
+class Recorder(threading.Thread):
+    """Write blocks in format `wavefx` to `path`, a .wav path gets a RIFF
+         header. Up to `queueSize` blocks wait for the disk. Selection
+         changes go to `sidecar`, by default the path with .selection.csv
+         in place of its extension, None for no sidecar."""
+    def __init__(self, path, wavefx, queueSize=64, sidecar='', bufferSize=BUFFER_SIZE):
+        super(Recorder, self).__init__()
+        self.daemon = True
+        self.path = path
+        self.wavefx = wavefx
+        self.sidecar = os.path.splitext(path)[0] + '.selection.csv' if sidecar == '' else sidecar
+        self.bufferSize = bufferSize
+        self.queue = queue.Queue(queueSize)
+        self.marks = collections.deque()
+        #: frames handed to record(), the timeline of the sidecar
+        self.frames = 0
+        self.recordedBytes = 0
+        self.dropped = 0
+        self.droppedBytes = 0
+        self.error = None
+
+    def record(self, data):
+        """Queue a copy of `data`, never blocks. Returns False if the block
+             was dropped because the queue is full."""
+        frames = len(data) // self.wavefx.nBlockAlign
+        frame = self.frames
+        self.frames += frames
+        try:
+            self.queue.put_nowait(bytes(data))
+        except queue.Full:
+            self.dropped += 1
+            self.droppedBytes += len(data)
+            self.marks.append((frame, 'drop', frames, ''))
+            return False
+        return True
+
+    def mark(self, stream, name='', frame=None):
+        """note that `stream` was selected at `frame`, by default the end
+             of the audio recorded so far"""
+        self.marks.append((self.frames if frame is None else frame, 'select', stream, name))
+
+    def close(self):
+        """write the queued blocks and close the files"""
+        if not self.is_alive():
+            return
+        self.queue.put(None)
+        self.join()
+
+    def stats(self):
+        return {'frames': self.frames,
+                'recordedBytes': self.recordedBytes,
+                'queued': self.queue.qsize(),
+                'dropped': self.dropped,
+                'droppedBytes': self.droppedBytes,
+                'error': str(self.error) if self.error else None}
+
+    def run(self):
+        output = open(self.path, 'wb', buffering=self.bufferSize)
+        sidecarFile = open(self.sidecar, 'w', encoding='utf-8', newline='') if self.sidecar else None
+        sidecar = csv.writer(sidecarFile) if sidecarFile else None
+        writer = None
+        if self.path.lower().endswith('.wav'):
+            writer = wave.open(output, 'wb')
+            writer.setnchannels(self.wavefx.nChannels)
+            writer.setsampwidth(self.wavefx.wBitsPerSample // 8)
+            writer.setframerate(self.wavefx.SamplesPerSec)
+        if sidecar:
+            sidecar.writerow(('frame', 'seconds', 'event', 'value', 'name'))
+        debug("recording to %s", self.path)
+        try:
+            while True:
+                try:
+                    data = self.queue.get(timeout=0.5)
+                except queue.Empty:
+                    data = b''
+                if sidecar:
+                    self._writeMarks(sidecar)
+                if data is None:
+                    break
+                if not data or self.error:
+                    # after a disk error the queue is still drained
+                    continue
+                try:
+                    if writer:
+                        writer.writeframesraw(data)
+                    else:
+                        output.write(data)
+                    self.recordedBytes += len(data)
+                except OSError as ex:
+                    self.error = ex
+                    debug("recording stopped: %s", ex)
+        finally:
+            if writer:
+                writer.close()
+            output.close()
+            if sidecar:
+                self._writeMarks(sidecar)
+                sidecarFile.close()
+        debug("recorded %d bytes, dropped %d blocks", self.recordedBytes, self.dropped)
+
+    def _writeMarks(self, sidecar):
+        rate = float(self.wavefx.SamplesPerSec)
+        while self.marks:
+            frame, event, value, name = self.marks.popleft()
+            sidecar.writerow((frame, '%.3f' % (frame / rate), event, value, name))
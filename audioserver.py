@@ -0,0 +1,209 @@
+#!python3
+# -*- coding:utf-8 -*-
+"""
+asyncio server of many raw PCM TCP streams feeding the excitation selector.
+
+Every client connection carries one headerless PCM stream (16bit signed,
+little endian, like audiosocket.SocketStream). asyncio receives the data
+with recv_into straight into a preallocated block buffer of the connection,
+every full block is metered and the stream with the greatest average block
+peak of each window is selected, the decision Dialog.caculate makes for
+files.
+
+Unlike SocketStream the server serves any number of clients from one
+thread and Ctrl-C stops it at any time. A loopback load generator is built
+in:
+
+    python audioserver.py --port 44100                 # serve until Ctrl-C
+    python audioserver.py --clients 200 --duration 10  # local load test
+"""
+
+import time
+import asyncio
+import argparse
+import numpy as np
+import audiometer
+import audioconvert
+
+DEBUG = False
+def debug(msg, *args):
+    """print `msg` % `args`, formatted only if DEBUG is on"""
+    if DEBUG:
+        print("debug: %s" % (msg % args if args else msg))
+
+
+class StreamProtocol(asyncio.BufferedProtocol):
+    """One client connection, received data goes into self.block"""
+    def __init__(self, server):
+        self.server = server
+        self.block = bytearray(server.blockSize)
+        self.view = memoryview(self.block)
+        self.filled = 0
+        self.slot = None
+        self.peer = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.peer = transport.get_extra_info('peername')
+        self.slot = self.server.attach(self)
+
+    def get_buffer(self, sizehint):
+        return self.view[self.filled:]
+
+    def buffer_updated(self, nbytes):
+        self.filled += nbytes
+        if self.filled == len(self.block):
+            self.server.onBlock(self.slot, self.block)
+            self.filled = 0
+
+    def connection_lost(self, exc):
+        self.server.detach(self)
+
+
+class ExcitationServer(object):
+    """Serve PCM streams in format `wavefx` (16kHz mono 16bit by default),
+         meter them in blocks of `blockSeconds` and select the loudest
+         stream every `window` seconds.
+
+         `onSelect(slot, peer)` is called with the selected connection
+         after every window."""
+    def __init__(self, wavefx=None, blockSeconds=0.1, window=2.0):
+        self.wavefx = wavefx or audioconvert.pcmFormat(16000, 1)
+        frames = int(self.wavefx.SamplesPerSec * blockSeconds)
+        self.blockSize = frames * self.wavefx.nBlockAlign
+        self.window = window
+        self.onSelect = None
+        self.connections = {}   # slot: StreamProtocol
+        self.capacity = 0
+        self.sums = np.zeros(0)
+        self.counts = np.zeros(0)
+        self.blocks = 0
+        self.selected = None
+
+    def attach(self, protocol):
+        """give the connection a free slot of the level tables"""
+        slot = 0
+        while slot in self.connections:
+            slot += 1
+        if slot >= self.capacity:
+            grow = max(16, self.capacity)
+            self.capacity += grow
+            # np.resize would fill the new slots with copies of the old ones
+            self.sums = np.concatenate((self.sums, np.zeros(grow)))
+            self.counts = np.concatenate((self.counts, np.zeros(grow)))
+        self.sums[slot] = self.counts[slot] = 0
+        self.connections[slot] = protocol
+        debug("stream %d from %s", slot, protocol.peer)
+        return slot
+
+    def detach(self, protocol):
+        self.connections.pop(protocol.slot, None)
+        self.sums[protocol.slot] = self.counts[protocol.slot] = 0
+
+    def onBlock(self, slot, block):
+        self.sums[slot] += audiometer.blockPeak(block, self.wavefx.nChannels)
+        self.counts[slot] += 1
+        self.blocks += 1
+
+    def select(self):
+        """slot of the loudest stream of the last window, None if no stream
+             sent a full block"""
+        active = self.counts > 0
+        attached = np.zeros(self.capacity, bool)
+        attached[list(self.connections)] = True
+        active &= attached
+        averages = np.where(active, self.sums / np.maximum(self.counts, 1), -1)
+        self.sums[:] = 0
+        self.counts[:] = 0
+        if not active.any():
+            return None
+        # like Dialog.caculate the first stream wins ties and silence
+        if averages.max() > 0:
+            return int(averages.argmax())
+        return int(active.argmax())
+
+    async def selectLoop(self):
+        while True:
+            await asyncio.sleep(self.window)
+            self.selected = self.select()
+            if self.selected is not None and self.onSelect:
+                self.onSelect(self.selected, self.connections[self.selected].peer)
+
+    async def serve(self, host='localhost', port=44100):
+        """serve forever"""
+        loop = asyncio.get_running_loop()
+        server = await loop.create_server(lambda: StreamProtocol(self), host, port, reuse_address=True)
+        selector = asyncio.ensure_future(self.selectLoop())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            selector.cancel()
+
+
+async def loadClient(host, port, wavefx, amplitude, duration, blockSeconds=0.02):
+    """Send a tone of `amplitude` at real time pace for `duration` seconds"""
+    reader, writer = await asyncio.open_connection(host, port)
+    frames = int(wavefx.SamplesPerSec * blockSeconds)
+    tone = amplitude * np.sin(2 * np.pi * 440 * np.arange(frames) / wavefx.SamplesPerSec)
+    block = np.repeat(tone, wavefx.nChannels).astype('<i2').tobytes()
+    start = time.perf_counter()
+    sent = 0
+    while sent < duration:
+        writer.write(block)
+        await writer.drain()
+        sent += blockSeconds
+        delay = start + sent - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    writer.close()
+    await writer.wait_closed()
+
+
+async def loadTest(server, host, port, clients, duration):
+    """Serve `clients` loopback connections of rising loudness, returns
+         the CPU time of the process (server and clients) per wall second"""
+    loop = asyncio.get_running_loop()
+    listener = await loop.create_server(lambda: StreamProtocol(server), host, port, reuse_address=True)
+    selector = asyncio.ensure_future(server.selectLoop())
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    await asyncio.gather(*[loadClient(host, port, server.wavefx, 100 + 30000 * i // clients, duration)
+                           for i in range(clients)])
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    selector.cancel()
+    listener.close()
+    await listener.wait_closed()
+    return cpu / wall
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Select the loudest of many raw PCM TCP streams')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=44100)
+    parser.add_argument('--rate', type=int, default=16000, help='sample rate of the streams (default 16000)')
+    parser.add_argument('--channels', type=int, default=1, help='channels of the streams (default 1)')
+    parser.add_argument('-w', '--window', type=float, default=2.0, help='selection window in seconds (default 2)')
+    parser.add_argument('--clients', type=int, default=0, help='run a loopback load test with that many clients')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds of audio each load test client sends')
+    args = parser.parse_args(argv)
+
+    server = ExcitationServer(audioconvert.pcmFormat(args.rate, args.channels), window=args.window)
+    server.onSelect = lambda slot, peer: print("select stream %d from %s" % (slot, peer))
+    if args.clients:
+        load = asyncio.run(loadTest(server, args.host, args.port, args.clients, args.duration))
+        print("%d streams, %d blocks, CPU load of server and clients %.1f%% of one core" % (
+              args.clients, server.blocks, load * 100))
+        return
+    print("--- Playback from TCP port :%d ---" % args.port)
+    print("To feed an audio stream with netcat, execute:")
+    print("  nc -v localhost %d < sample.raw" % args.port)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -27,6 +27,18 @@ Change History:
 0.6 - Python 3 compatibility
 0.7 - socket stream playback, buffer underrun detection (not
             exposed in API), still Windows only
+0.8 - pluggable output backends (audiobackend module), null and
+            file sinks play without a sound card on any platform
+0.9 - block completion is signaled by the device, the writer sleeps
+            until a block of the configurable ring is done, no polling
+0.10 - blocks are read with readinto into preallocated buffers that
+            are handed to the device without copying
+0.11 - wave files are parsed by wavfile module and played in their own
+            format
+0.12 - adaptive jitter buffer for socket streams (jitterbuffer module),
+            underrun and overrun counts are exposed in its stats()
+0.13 - G.711 and IMA-ADPCM streams (audiocodec module), the socket
+            format is set by SOCKET_FORMAT and decoded before playback
 
 Usage:
 
@@ -34,227 +46,112 @@ Just execute .py file for a demo, and look at the end of the source
 code too see how it is used as a library.
 """
 
-import sys
-import array
-import time
 import socket
 
 DEBUG = True # False
-def debug(msg):
+def debug(msg, *args):
+    """print `msg` % `args`, formatted only if DEBUG is on"""
     if DEBUG:
-        print("debug: %s" % msg)
+        print("debug: %s" % (msg % args if args else msg))
 
-#-- CHAPTER 1: CONTINUOUS SOUND PLAYBACK WITH WINDOWS WINMM LIBRARY --
+#-- CHAPTER 1: CONTINUOUS SOUND PLAYBACK --
 #
-# Based on tutorial "Playing Audio in Windows using waveOut Interface"
-# by David Overton
-
-import ctypes
-from ctypes import wintypes
-
-winmm = ctypes.windll.winmm
-
-# --- define necessary data structures from mmsystem.h
-
-# 1. Open Sound Device
-
-HWAVEOUT = wintypes.HANDLE
-WAVE_FORMAT_PCM = 0x1
-WAVE_MAPPER = -1
-MMSYSERR_NOERROR = 0
-
-class WAVEFORMATEX(ctypes.Structure):
-    _fields_ = [
-        ('wFormatTag',  wintypes.WORD),
-            # 0x0001    WAVE_FORMAT_PCM. PCM audio
-            # 0xFFFE    The format is specified in the WAVEFORMATEXTENSIBLE.SubFormat
-            # Other values are in mmreg.h 
-        ('nChannels',   wintypes.WORD),
-        ('SamplesPerSec',  wintypes.DWORD),
-        ('AvgBytesPerSec', wintypes.DWORD),
-            # for WAVE_FORMAT_PCM is the product of nSamplesPerSec and nBlockAlign
-        ('nBlockAlign', wintypes.WORD),
-            # for WAVE_FORMAT_PCM is the product of nChannels and wBitsPerSample
-            # divided by 8 (bits per byte)
-        ('wBitsPerSample', wintypes.WORD),
-            # for WAVE_FORMAT_PCM should be equal to 8 or 16
-        ('cbSize',      wintypes.WORD)]
-            # extra format information size, should be 0
-
-# Data must be processes in pieces that are multiple of
-# nBlockAlign bytes of data at a time. Written and read
-# data from a device must always start at the beginning
-# of a block. Playback of PCM data can not be started in
-# the middle of a sample on a non-block-aligned boundary.
-
-CALLBACK_NULL = 0
-
-# 2. Write Audio Blocks to Device
-
-PVOID = wintypes.HANDLE
-WAVERR_BASE = 32
-WAVERR_STILLPLAYING = WAVERR_BASE + 1
-class WAVEHDR(ctypes.Structure):
-    _fields_ = [
-        ('lpData', wintypes.LPSTR), # pointer to waveform buffer
-        ('dwBufferLength', wintypes.DWORD),  # in bytes
-        ('dwBytesRecorded', wintypes.DWORD), # when used in input
-        ('dwUser', wintypes.DWORD),          # user data
-        ('dwFlags', wintypes.DWORD),  # various WHDR_* flags set by Windows
-        ('dwLoops', wintypes.DWORD),  # times to loop, for output buffers only
-        ('lpNext', PVOID),            # reserved, struct wavehdr_tag *lpNext
-        ('reserved', wintypes.DWORD)] # reserved
-# The lpData, dwBufferLength, and dwFlags members must be set before calling
-# the waveInPrepareHeader or waveOutPrepareHeader function. (For either
-# function, the dwFlags member must be set to zero.)
-WHDR_DONE = 1  # Set by the device driver for finished buffers
-# --- /define ----------------------------------------
-
-
-# -- Notes on double buffering scheme to avoid lags --
-#
-# Windows maintains a queue of blocks sheduled for playback.
-# Any block passed through the waveOutPrepareHeader function
-# is inserted into the queue with waveOutWrite.
+# Device access is delegated to a backend from audiobackend module, the
+# default one plays through Windows WinMM library.
+
+import audiobackend
+import audiometer
+import wavfile
+import jitterbuffer
+import audioconvert
+import latency
 
 class AudioWriter():
-    def __init__(self):
-        self.hwaveout = HWAVEOUT()
-        self.wavefx = WAVEFORMATEX(
-            WAVE_FORMAT_PCM,
-            2,     # nChannels
-            44100, # SamplesPerSec
-            176400,# AvgBytesPerSec = 44100 SamplesPerSec * 4 nBlockAlign
-            4,     # nBlockAlign = 2 nChannels * 16 wBitsPerSample / 8 bits per byte
-            16,    # wBitsPerSample
-            0
-        )
-        # For gapless playback, we schedule two audio blocks at a time, each
-        # block with its own header
-        self.headers = [WAVEHDR(), WAVEHDR()]
+    def __init__(self, backend=None, blockCount=2):
+        """`backend` is an audiobackend.AudioBackend, by default the sound
+             card on Windows and a null sink on other platforms with a ring
+             of `blockCount` blocks"""
+        self.backend = backend or audiobackend.createBackend(blockCount=blockCount)
+        self.wavefx = audiobackend.defaultFormat()
 
         #: configurable size of chunks (data blocks) read from input stream
         self.BUFSIZE = 100 * 2**10
-        self.BYTESPERSEC = 176400  # needed to calculate buffer playback time
-
-    def open(self):
-        """ 1. Open default wave device, tune it for the incoming data flow
+        self.BYTESPERSEC = self.wavefx.AvgBytesPerSec
+        #: latency profile applied by open(), see latency module
+        self.latency = None
+        self.tuner = None
+
+    def open(self, wavefx=None):
+        """ 1. Open output device, tune it for the incoming data flow
+             described by `wavefx`, audiobackend.defaultFormat() if None
         """
-        ret = winmm.waveOutOpen(
-            ctypes.byref(self.hwaveout), # buffer to receive a handle identifying
-                                                            # the open waveform-audio output device
-            WAVE_MAPPER,            # constant to point to default wave device
-            ctypes.byref(self.wavefx),   # identifier for data format sent for device
-            0, # DWORD_PTR dwCallback - callback function
-            0, # DWORD_PTR dwCallbackInstance - user instance data for callback
-            CALLBACK_NULL  # DWORD fdwOpen - flag for opening the device
-        )
-
-        if ret != MMSYSERR_NOERROR:
-            sys.exit('Error opening default waveform audio device (WAVE_MAPPER)')
-
-        debug( "Default Wave Audio output device is opened successfully" )
-
-    def _schedule_block(self, data, header):
-        """Schedule PCM audio data block for playback. header parameter
-             references free WAVEHDR structure to be used for scheduling."""
-        header.dwBufferLength = len(data)
-        header.lpData = data
-
-        # Prepare block for playback
-        if winmm.waveOutPrepareHeader(
-                 self.hwaveout, ctypes.byref(header), ctypes.sizeof(header)
-             ) != MMSYSERR_NOERROR:
-            sys.exit('Error: waveOutPrepareHeader failed')
-
-        # Write block, returns immediately unless a synchronous driver is
-        # used (not often)
-        if winmm.waveOutWrite(
-                 self.hwaveout, ctypes.byref(header), ctypes.sizeof(header)
-             ) != MMSYSERR_NOERROR:
-            sys.exit('Error: waveOutWrite failed')
+        if wavefx:
+            self.wavefx = wavefx
+            self.BYTESPERSEC = wavefx.AvgBytesPerSec
+        self.tuner = latency.configure(self)
+        self.backend.open(self.wavefx)
 
     def play(self, stream):
         """Read PCM audio blocks from stream and write to the output device
 
-             `stream` is anything with .read() method. Playback stops if read
+             `stream` is anything with .readinto() method, blocks are read
+             into a ring of preallocated buffers, one per device block, and
+             handed to the device without copying. Playback stops if read
              operation returned 0 bytes
         """
+        buffers = [bytearray(self.BUFSIZE) for i in range(self.backend.blockCount)]
 
-        blocknum = len(self.headers) #: number of audio data blocks to be queued
-        curblock = 0      #: start with block 0
         stopping = False  #: stopping playback when no input
         prevlen  = 0      #: previously read length to detect buffer underruns
-        divideBase = 1.05
         while True:
-            debug("dwFlags 0:{0}, 1:{1}".format(self.headers[0].dwFlags, self.headers[1].dwFlags))
-            freeids = [x for x in range(blocknum)
-                                     if self.headers[x].dwFlags in (0, WHDR_DONE)]
-            if (len(freeids) == blocknum) and stopping:
+            freeids = self.backend.freeBlocks()
+            if stopping and not self.backend.pending:
                 break
-            debug("empty blocks %s" % freeids)
+            debug("empty blocks %s", freeids)
 
             # Fill audio queue
             for i in freeids:
                 if stopping:
                     break
-                debug("scheduling block %d" % i)
-                data = stream.read(self.BUFSIZE)
-                readlen = len(data)
+                debug("scheduling block %d", i)
+                blockSize = self.tuner.blockSize if self.tuner else self.BUFSIZE
+                readlen = stream.readinto(memoryview(buffers[i])[:blockSize])
                 if readlen == 0:
                     stopping = True
                     break
-                if prevlen < self.BUFSIZE and readlen < self.BUFSIZE:
-                    debug("  underrun warn - read %s/%s (%d%%) of buffer size" %
-                                (readlen, self.BUFSIZE, readlen*100//self.BUFSIZE))
-                shortArray = array.array('h') # int16
-                shortArray.frombytes(data)
-                debug("block max num                 {0}".format(max(shortArray)))
-                self._schedule_block(data, self.headers[i])
-
-            debug("waiting for block %d" % curblock)
-
-            # waiting until buffer playback is finished by constantly polling
-            # its status eats 100% CPU time. this counts how many checks are made
-            pollsnum = 0
-            # avoid 100% CPU usage - with this pollsnum won't be greater than 1
-            time.sleep(readlen/divideBase/float(self.BYTESPERSEC)) # must devide a number greater that 1, make pollsnum greater than 1, otherwise there will be a gap between them
-
-            while True:
-                pollsnum += 1
-                # unpreparing the header fails until the block is played
-                ret = winmm.waveOutUnprepareHeader(
-                                self.hwaveout,
-                                ctypes.byref(self.headers[curblock]),
-                                ctypes.sizeof(self.headers[curblock])
-                            )
-                if ret == WAVERR_STILLPLAYING:
-                    continue
-                if ret != MMSYSERR_NOERROR:
-                    sys.exit('Error: waveOutUnprepareHeader failed with code 0x%x' % ret)
-                debug("dwFlags {0}:{1}".format(curblock, self.headers[curblock].dwFlags))
-                break
-            debug("  %s check(s)" % pollsnum)
-            if pollsnum == 1:
-                divideBase += 0.01
-
-            # Switch waiting pointer to the next block
-            curblock = (curblock + 1) % len(self.headers)
+                if prevlen < blockSize and readlen < blockSize:
+                    debug("  underrun warn - read %s/%s (%d%%) of buffer size",
+                          readlen, blockSize, readlen*100//blockSize)
+                data = memoryview(buffers[i])[:readlen]
+                if DEBUG:
+                    debug("block max num                 %s",
+                          audiometer.blockPeak(data, self.wavefx.nChannels))
+                self.backend.scheduleBlock(data, i)
+                if self.tuner:
+                    self.tuner.update(self.backend.underruns, readlen)
+
+            # sleep until the device is done with a block
+            debug("block %s is done", self.backend.waitCompletion())
             prevlen = readlen
 
     def close(self):
-        """ x. Close Sound Device """
-        winmm.waveOutClose(self.hwaveout)
-        debug( "Default Wave Audio output device is closed" )
+        """ x. Close output device """
+        self.backend.close()
 
 #-- /CHAPTER 1 --
 
 #-- CHAPTER 2: READING STREAM FROM THE SOCKET --
 
+#: format of the raw stream sent to the socket by the example, e.g.
+#: audiocodec.codecFormat('mulaw', 8000) for G.711 telephony audio
+SOCKET_FORMAT = None
+
 class SocketStream(object):
     """ Convert network socket connection to a readable stream object """
-    def __init__(self, host='localhost', port=44100):
-        """Wait until there is a connection"""
+    def __init__(self, host='localhost', port=44100, wavefx=None):
+        """Wait until there is a connection carrying data in format
+             `wavefx`, audiobackend.defaultFormat() if None"""
+        self.wavefx = wavefx or audiobackend.defaultFormat()
         # [ ] listening socket blocks keyboard input, so CtrlC/CtrlBreak
         #     will not work until a new connection is established
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -268,6 +165,9 @@ class SocketStream(object):
     def read(self, size):
         return self.conn.recv(size)
 
+    def readinto(self, buffer):
+        return self.conn.recv_into(buffer)
+
     def close(self):
         self.conn.close()
         try:
@@ -279,12 +179,11 @@ class SocketStream(object):
 
 if __name__ == '__main__':
     print("--- Local file playback example ---")
+    stream = wavfile.openReader('e:\\Media\\Audio\\qianqian44100.wav')
     aw = AudioWriter()
-    aw.open()
-    
-    # PCM 16bit, little endian, signed, 44.1kHz, stereo, left interleaved
-    with open('e:\\Media\\Audio\\qianqian44100.wav', 'rb') as stream:
-        aw.play(stream)
+    aw.open(stream.wavefx)
+    aw.play(stream)
+    stream.close()
 
     aw.close()
 
@@ -297,9 +196,15 @@ if __name__ == '__main__':
     aw.open()
 
     while True:      
-        stream = SocketStream(host='')
-        print("got signal from %s:%s" % stream.addr)
+        sock = SocketStream(host='', wavefx=SOCKET_FORMAT)
+        print("got signal from %s:%s" % sock.addr)
+        # nc sends faster than real time, let it wait instead of dropping data
+        jitter = jitterbuffer.JitterStream(sock, sock.wavefx, dropOldest=False)
+        stream = jitter
+        if not audioconvert.isInt16(sock.wavefx):
+            stream = audioconvert.ConvertingStream(jitter, aw.wavefx, sock.wavefx)
         aw.play(stream)
+        print("jitter buffer %s" % jitter.buffer.stats())
         stream.close()
 
     aw.close()
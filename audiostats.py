@@ -0,0 +1,142 @@
+#!python3
+# -*- coding:utf-8 -*-
+"""
+Runtime metrics of the playback engine.
+
+A PlaybackStats object collects counters and latency histograms of one
+writer or mixer thread. Writers only measure when their `stats` attribute
+is set, so a writer without stats pays one attribute test per block:
+
+    >>> aw.stats = PlaybackStats('sample.wav')
+    >>> aw.start(); ...
+    >>> aw.stats.snapshot()['histograms']['wait']['mean']
+    >>> dump([aw.stats for aw in writers], open('stats.json', 'w'))
+
+Counters of the writers:
+
+    blocks      blocks scheduled to the device
+    bytes       bytes scheduled to the device
+    underruns   blocks shorter than the block size after a short one
+    cpu         thread CPU seconds spent in the playback loop
+
+Histograms (seconds):
+
+    schedule    read, meter and schedule of a block
+    meter       metering of a block
+    wait        sleep until the device completes a block
+"""
+
+import json
+import time
+import threading
+
+#: histogram buckets are powers of two of microseconds, up to ~36 minutes
+BUCKETS = 32
+
+
+class Histogram(object):
+    """Count, sum, extremes and power of two buckets of durations"""
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.buckets = [0] * BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+        # bucket b holds durations under 2**b microseconds
+        self.buckets[min(int(seconds * 1e6).bit_length(), BUCKETS - 1)] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+        self.buckets = [a + b for (a, b) in zip(self.buckets, other.buckets)]
+
+    def quantile(self, q):
+        """upper bound of the bucket holding quantile `q`, in seconds"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for (bucket, count) in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min((1 << bucket) / 1e6, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count else 0.0,
+                'min': self.min or 0.0,
+                'max': self.max,
+                'p50': self.quantile(0.5),
+                'p99': self.quantile(0.99),
+                'buckets': {'<%dus' % (1 << b): n for (b, n) in enumerate(self.buckets) if n}}
+
+
+class PlaybackStats(object):
+    """Counters and histograms of the stream `name`, safe to read from
+         other threads while the writer updates them"""
+    def __init__(self, name=''):
+        self.name = name
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def count(self, counter, value=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def observe(self, histogram, seconds):
+        with self.lock:
+            if histogram not in self.histograms:
+                self.histograms[histogram] = Histogram()
+            self.histograms[histogram].add(seconds)
+
+    def merge(self, other):
+        with self.lock:
+            for (name, value) in other.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for (name, histogram) in other.histograms.items():
+                self.histograms.setdefault(name, Histogram()).merge(histogram)
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    def snapshot(self):
+        """dict of plain values, ready for json"""
+        with self.lock:
+            return {'name': self.name,
+                    'counters': dict(self.counters),
+                    'histograms': {name: it.snapshot() for (name, it) in self.histograms.items()}}
+
+
+def timer():
+    """clock of the histograms"""
+    return time.perf_counter()
+
+
+def aggregate(stats, name='total'):
+    """PlaybackStats summing a list of PlaybackStats"""
+    total = PlaybackStats(name)
+    for it in stats:
+        total.merge(it)
+    return total
+
+
+def dump(stats, output):
+    """write every PlaybackStats of the list and their aggregate as JSON"""
+    json.dump({'streams': [it.snapshot() for it in stats],
+               'total': aggregate(stats).snapshot()}, output, indent=1)
+    output.write('\n')
@@ -0,0 +1,251 @@
+#!python3
+# -*- coding:utf-8 -*-
+"""
+Headless benchmarks of the metering, scheduling and multi-stream paths.
+
+All audio is synthetic (tone, noise and speech-like bursts) and is played
+through audiobackend.NullBackend, which completes blocks as soon as they
+are waited for, so every figure is the cost of the Python side alone.
+Throughput is given in multiples of real time, CPU in percent of one core
+per stream of real time audio:
+
+    python benchmark.py                        # everything
+    python benchmark.py meter --seconds 60
+    python benchmark.py streams --counts 1 10 100 500 --mode mixer
+    python benchmark.py all --json > baseline.json
+"""
+
+import io
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import audiobackend
+import audiocore
+import audiometer
+import audiomixer
+import audiostats
+
+#: block sizes of the metering benchmark, in frames
+METER_BLOCKS = (256, 1024, 4096, 10240, 44100)
+#: stream counts of the scaling benchmark
+STREAM_COUNTS = (1, 10, 50, 100, 200, 500)
+
+
+#-- synthetic PCM --
+
+def tone(seconds, wavefx, frequency=440.0, amplitude=0.5):
+    """interleaved int16 sine"""
+    rate = wavefx.SamplesPerSec
+    wave = amplitude * np.sin(2 * np.pi * frequency * np.arange(int(seconds * rate)) / rate)
+    return _toInt16(wave, wavefx)
+
+
+def noise(seconds, wavefx, amplitude=0.3, seed=0):
+    """interleaved int16 white noise"""
+    random = np.random.RandomState(seed)
+    wave = amplitude * random.uniform(-1, 1, int(seconds * wavefx.SamplesPerSec))
+    return _toInt16(wave, wavefx)
+
+
+def speech(seconds, wavefx, amplitude=0.6, seed=0):
+    """interleaved int16 speech-like bursts: band limited noise shaped by
+         syllables of ~4Hz grouped into phrases with pauses between them"""
+    rate = wavefx.SamplesPerSec
+    random = np.random.RandomState(seed)
+    frames = int(seconds * rate)
+    t = np.arange(frames) / float(rate)
+    voiced = np.convolve(random.uniform(-1, 1, frames), np.hanning(int(rate / 1000.0) or 1), 'same')
+    voiced /= np.abs(voiced).max() or 1
+    syllables = np.maximum(np.sin(2 * np.pi * 4 * t), 0) ** 2
+    phrases = np.repeat(random.uniform(size=int(seconds) + 1) > 0.3, rate)[:frames]
+    return _toInt16(amplitude * voiced * syllables * phrases, wavefx)
+
+
+def _toInt16(wave, wavefx):
+    samples = np.clip(np.rint(wave * 32767), -32768, 32767).astype(np.int16)
+    return np.repeat(samples, wavefx.nChannels)
+
+GENERATORS = (tone, noise, speech)
+
+
+def _realtime(seconds, wall):
+    return seconds / wall if wall else float('inf')
+
+
+#-- benchmarks --
+
+def benchMeter(seconds=30.0, wavefx=None, blockFrames=METER_BLOCKS):
+    """audiometer.blockPeak and a batched audiometer.measure of `seconds`
+         of speech for every block size"""
+    wavefx = wavefx or audiobackend.defaultFormat()
+    samples = speech(seconds, wavefx)
+    data = samples.tobytes()
+    channels = wavefx.nChannels
+    results = []
+    for frames in blockFrames:
+        size = frames * wavefx.nBlockAlign
+        blocks = len(data) // size
+        view = memoryview(data)
+        started = time.perf_counter()
+        for i in range(blocks):
+            audiometer.blockPeak(view[i * size:(i + 1) * size], channels)
+        perBlock = time.perf_counter() - started
+        started = time.perf_counter()
+        audiometer.measure(samples[:blocks * frames * channels].reshape(blocks, -1), channels)
+        batched = time.perf_counter() - started
+        audio = blocks * frames / float(wavefx.SamplesPerSec)
+        results.append({'blockFrames': frames, 'blocks': blocks,
+                        'realtime': _realtime(audio, perBlock),
+                        'batchedRealtime': _realtime(audio, batched),
+                        'usPerBlock': perBlock / blocks * 1e6 if blocks else 0.0})
+    return results
+
+
+def _writer(stream, wavefx, blockCount=2, bufsize=None):
+    """audiocore.AudioWriter playing `stream` to a null device, opened like
+         AudioWriter.open opens a file"""
+    writer = audiocore.AudioWriter(audiobackend.NullBackend(blockCount))
+    if bufsize:
+        writer.BUFSIZE = bufsize
+    writer.file = 'benchmark'
+    writer.stream = stream
+    writer.wavefx = wavefx
+    writer.BYTESPERSEC = wavefx.AvgBytesPerSec
+    writer.backend.open(wavefx)
+    writer.stats = audiostats.PlaybackStats(writer.name)
+    return writer
+
+
+def benchSchedule(seconds=60.0, wavefx=None, blockCount=2, bufsize=None):
+    """the run() loop of audiocore.AudioWriter, metering included, against
+         a null device"""
+    wavefx = wavefx or audiobackend.defaultFormat()
+    data = tone(seconds, wavefx).tobytes()
+    writer = _writer(io.BytesIO(data), wavefx, blockCount, bufsize)
+    cpu = time.process_time()
+    started = time.perf_counter()
+    writer.start()
+    writer.join()
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu
+    writer.close()
+    blocks = -(-len(data) // writer.BUFSIZE)
+    return {'seconds': seconds, 'blockCount': blockCount, 'bufsize': writer.BUFSIZE,
+            'realtime': _realtime(seconds, wall),
+            'usPerBlock': wall / blocks * 1e6,
+            'cpu': cpu / seconds * 100}
+
+
+def _inputs(count, seconds, wavefx):
+    sources = [generator(seconds, wavefx).tobytes() for generator in GENERATORS]
+    # BytesIO shares the bytes of its initial value until it is written
+    return [io.BytesIO(sources[i % len(sources)]) for i in range(count)]
+
+
+def benchMixer(count, seconds, wavefx, blockCount=2):
+    """`count` streams through one audiomixer.AudioMixer, like Dialog.play"""
+    mixer = audiomixer.AudioMixer(audiobackend.NullBackend(blockCount))
+    for (i, stream) in enumerate(_inputs(count, seconds, wavefx)):
+        mixer.inputs.append(audiomixer.MixerInput(stream, 'stream %d' % i, wavefx))
+    mixer.open()
+    mixer.meterFrames = wavefx.SamplesPerSec // 10
+    mixer.stats = audiostats.PlaybackStats('mixer')
+    cpu = time.process_time()
+    started = time.perf_counter()
+    mixer.start()
+    mixer.join()
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu
+    mixer.close()
+    return wall, cpu, mixer.stats
+
+
+def benchWriters(count, seconds, wavefx, blockCount=2):
+    """`count` audiocore.AudioWriter threads with a device each, metering
+         every block like the mixer does"""
+    writers = [_writer(stream, wavefx, blockCount) for stream in _inputs(count, seconds, wavefx)]
+    cpu = time.process_time()
+    started = time.perf_counter()
+    for it in writers:
+        it.start()
+    for it in writers:
+        it.join()
+    wall = time.perf_counter() - started
+    cpu = time.process_time() - cpu
+    for it in writers:
+        it.close()
+    return wall, cpu, audiostats.aggregate([it.stats for it in writers])
+
+
+def benchStreams(counts=STREAM_COUNTS, seconds=10.0, wavefx=None, mode='mixer'):
+    """Scale from few to many streams, `mode` is 'mixer' or 'writers'"""
+    wavefx = wavefx or audiobackend.defaultFormat()
+    bench = benchMixer if mode == 'mixer' else benchWriters
+    results = []
+    for count in counts:
+        wall, cpu, stats = bench(count, seconds, wavefx)
+        result = {'mode': mode, 'streams': count,
+                  'realtime': _realtime(seconds, wall),
+                  'cpuPerStream': cpu / seconds / count * 100}
+        if stats:
+            result['scheduleP99'] = stats.snapshot()['histograms']['schedule']['p99']
+        results.append(result)
+    return results
+
+
+#-- report --
+
+def printMeter(results, output):
+    output.write("metering, realtime multiples\n")
+    output.write("%12s %10s %12s %14s\n" % ('block frames', 'us/block', 'per block', 'batched'))
+    for it in results:
+        output.write("%12d %10.1f %11.0fx %13.0fx\n" % (it['blockFrames'], it['usPerBlock'],
+                                                       it['realtime'], it['batchedRealtime']))
+
+
+def printSchedule(result, output):
+    output.write("scheduling loop, %d blocks of %d bytes: %.0fx realtime, %.1f us/block, %.3f%% CPU\n" % (
+                 result['blockCount'], result['bufsize'], result['realtime'], result['usPerBlock'], result['cpu']))
+
+
+def printStreams(results, output):
+    output.write("streams, %s\n" % results[0]['mode'] if results else "streams\n")
+    output.write("%8s %10s %14s\n" % ('streams', 'realtime', 'CPU/stream'))
+    for it in results:
+        output.write("%8d %9.1fx %13.3f%%\n" % (it['streams'], it['realtime'], it['cpuPerStream']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark metering, scheduling and stream scaling')
+    parser.add_argument('suite', nargs='?', default='all', choices=('all', 'meter', 'schedule', 'streams'))
+    parser.add_argument('--seconds', type=float, default=None, help='seconds of audio per stream')
+    parser.add_argument('--counts', type=int, nargs='+', default=list(STREAM_COUNTS), help='stream counts to scale over')
+    parser.add_argument('--mode', choices=('mixer', 'writers', 'both'), default='both',
+                        help='one mixer thread or a writer thread per stream')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    results = {}
+    if args.suite in ('all', 'meter'):
+        results['meter'] = benchMeter(args.seconds or 30.0)
+    if args.suite in ('all', 'schedule'):
+        results['schedule'] = benchSchedule(args.seconds or 60.0)
+    if args.suite in ('all', 'streams'):
+        modes = ('mixer', 'writers') if args.mode == 'both' else (args.mode,)
+        results['streams'] = [benchStreams(args.counts, args.seconds or 10.0, mode=mode) for mode in modes]
+    if args.json:
+        json.dump(results, sys.stdout, indent=1)
+        sys.stdout.write('\n')
+        return
+    if 'meter' in results:
+        printMeter(results['meter'], sys.stdout)
+    if 'schedule' in results:
+        printSchedule(results['schedule'], sys.stdout)
+    for it in results.get('streams', []):
+        printStreams(it, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
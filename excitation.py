@@ -0,0 +1,99 @@
+#!python3
+# -*- coding:utf-8 -*-
+"""
+Incremental audio excitation (语音激励) engine.
+
+ExcitationEngine picks the loudest of many streams every time a block of
+levels arrives, instead of averaging a fixed 2 second window like
+Dialog.caculate did. Each update is O(1) per stream:
+
+    1. the block peak of every stream is smoothed with an exponential
+       moving average or a sliding window average of `window` seconds,
+    2. streams whose smoothed level is under `noiseFloor` dBFS are gated
+       out, so line noise never wins,
+    3. the loudest remaining stream takes over when it beats the selected
+       one by `hysteresis` dB and the current selection was held for at
+       least `hold` seconds, or at once when the selected stream fell
+       silent.
+
+With ewma a clean hand-over between two talkers of equal level takes
+about window * ln(1 + 10**(hysteresis/20)) seconds, 0.88 window with 3dB,
+plus up to one block. The default window of 0.15s switches in 150ms at
+blocks of 50ms; longer windows ride out short pauses better but switch
+later.
+
+The engine has no Qt dependency and is driven by the mixer, the servers or
+offline analysis alike:
+
+    >>> engine = ExcitationEngine(len(files), blockSeconds=0.1)
+    >>> selected = engine.update(peaks)     # one peak per stream
+"""
+
+import numpy as np
+import audiometer
+
+
+class ExcitationEngine(object):
+    """Select one of `streamCount` streams from block levels that arrive
+         every `blockSeconds`. `mode` is 'ewma' or 'sliding'."""
+    def __init__(self, streamCount, blockSeconds, window=0.15, mode='ewma',
+                 noiseFloor=-50.0, hold=0.2, hysteresis=3.0):
+        if mode not in ('ewma', 'sliding'):
+            raise ValueError('unknown smoothing mode %r' % mode)
+        self.streamCount = streamCount
+        self.blockSeconds = blockSeconds
+        self.mode = mode
+        self.noiseFloor = noiseFloor
+        self.hold = hold
+        self.hysteresis = hysteresis
+        self.alpha = 1 - np.exp(-blockSeconds / float(window))
+        self.windowBlocks = max(1, int(round(window / float(blockSeconds))))
+        self.reset()
+
+    def reset(self):
+        self.smoothed = np.zeros(self.streamCount)
+        # sliding window: ring of the last block levels and their sum
+        self.history = np.zeros((self.windowBlocks, self.streamCount)) if self.mode == 'sliding' else None
+        self.historyPos = 0
+        self.historySum = np.zeros(self.streamCount)
+        self.blocks = 0
+        self.selected = None
+        self.selectedAt = 0     #: block of the last switch
+        self.switches = 0
+
+    def levels(self):
+        """smoothed levels in dBFS"""
+        return audiometer.dbfs(self.smoothed)
+
+    def update(self, peaks):
+        """Feed the block peak of every stream, returns the selected stream
+             index, None until a stream gets over the noise floor"""
+        peaks = np.asarray(peaks, np.float64)
+        if self.history is None:
+            self.smoothed += self.alpha * (peaks - self.smoothed)
+        else:
+            self.historySum += peaks - self.history[self.historyPos]
+            self.history[self.historyPos] = peaks
+            self.historyPos = (self.historyPos + 1) % self.windowBlocks
+            self.smoothed = self.historySum / min(self.blocks + 1, self.windowBlocks)
+        self.blocks += 1
+
+        db = audiometer.dbfs(self.smoothed)
+        active = db >= self.noiseFloor
+        if not active.any():
+            return self.selected
+        candidate = int(np.where(active, db, -np.inf).argmax())
+        current = self.selected
+        if current is None or not active[current]:
+            self._select(candidate)
+        elif candidate != current:
+            held = (self.blocks - self.selectedAt) * self.blockSeconds >= self.hold
+            if held and db[candidate] >= db[current] + self.hysteresis:
+                self._select(candidate)
+        return self.selected
+
+    def _select(self, index):
+        if index != self.selected:
+            self.selected = index
+            self.selectedAt = self.blocks
+            self.switches += 1
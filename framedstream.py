@@ -0,0 +1,324 @@
+#!python3
+# -*- coding:utf-8 -*-
+"""
+Framed protocol carrying many audio streams over one connection.
+
+audiosocket.SocketStream and audioserver take one headerless PCM stream per
+TCP connection, a gateway forwarding a hundred talkers needs a hundred
+sockets and the receiver knows neither format nor timing of the data. Here
+every frame of audio starts with a header of HEADER.size (32) bytes, little
+endian:
+
+    magic       b'AF'
+    version     1
+    flags       FLAG_END on the last (empty) frame of a stream
+    stream      stream id, 0-65535
+    format      wFormatTag, nChannels, wBitsPerSample, nBlockAlign and
+                SamplesPerSec of the WAVEFORMATEX of the payload
+    sequence    frame number in the stream, gaps count as lost frames
+    offset      sample frame of the stream the payload starts at
+    length      payload bytes, whole blocks of nBlockAlign
+
+FrameWriter sends header and payload with one sendmsg call without joining
+them. Demultiplexer receives with recv_into into one reusable buffer and
+hands every frame to `onFrame(frame, payload)`, `payload` is a memoryview
+slice of that buffer, valid until the callback returns. Copy it or pass it
+on, e.g. to a jitterbuffer.JitterBuffer per stream:
+
+    >>> demux = Demultiplexer()
+    >>> demux.onFrame = lambda frame, payload: buffers[frame.stream].write(payload)
+    >>> demux.receive(connection)
+
+FramedProtocol serves the same from asyncio like audioserver.StreamProtocol.
+A loopback load generator measures throughput and the cost per frame:
+
+    python framedstream.py --streams 100 --seconds 5 --frame 0.02
+"""
+
+import time
+import socket
+import struct
+import asyncio
+import argparse
+import collections
+import multiprocessing
+import numpy as np
+import audiobackend
+import audiocodec
+import audioconvert
+
+DEBUG = False
+def debug(msg, *args):
+    """print `msg` % `args`, formatted only if DEBUG is on"""
+    if DEBUG:
+        print("debug: %s" % (msg % args if args else msg))
+
+MAGIC = b'AF'
+VERSION = 1
+FLAG_END = 0x01
+# magic, version, flags, stream, format tag, channels, bits, block align, rate, sequence, offset, length
+HEADER = struct.Struct('<2sBBHHBBHIIQI')
+
+#: stream, sequence, offset (sample frame), wavefx, end of stream
+Frame = collections.namedtuple('Frame', 'stream sequence offset wavefx end')
+
+
+def waveFormat(tag, channels, bits, blockAlign, rate):
+    """WAVEFORMATEX of the format fields of a header"""
+    wavefx = audiobackend.WAVEFORMATEX(tag, channels, rate, 0, blockAlign, bits, 0)
+    wavefx.AvgBytesPerSec = rate * blockAlign // audiocodec.framesPerBlock(wavefx)
+    if tag == audiocodec.WAVE_FORMAT_IMA_ADPCM:
+        wavefx.cbSize = 2
+    return wavefx
+
+
+def packHeader(stream, sequence, offset, wavefx, length, flags=0):
+    return HEADER.pack(MAGIC, VERSION, flags, stream, wavefx.wFormatTag, wavefx.nChannels,
+                       wavefx.wBitsPerSample, wavefx.nBlockAlign, wavefx.SamplesPerSec,
+                       sequence & 0xFFFFFFFF, offset, length)
+
+
+class FrameWriter(object):
+    """Send frames of any number of streams over the connected socket
+         `sock`, sequence numbers and sample offsets are kept per stream"""
+    def __init__(self, sock):
+        self.sock = sock
+        self.sequences = {}   # stream: next sequence number
+        self.offsets = {}     # stream: next sample frame
+        self.frames = 0
+        self.bytes = 0
+
+    def send(self, stream, data, wavefx, offset=None):
+        """Send `data`, whole blocks of audio in format `wavefx`, as the next
+             frame of `stream`. `offset` is the sample frame it starts at,
+             by default where the last frame ended."""
+        data = memoryview(data).cast('B')
+        if len(data) % wavefx.nBlockAlign:
+            raise ValueError('payload of %d bytes is not whole blocks of %d bytes' % (len(data), wavefx.nBlockAlign))
+        sequence = self.sequences.get(stream, 0)
+        if offset is None:
+            offset = self.offsets.get(stream, 0)
+        self.sequences[stream] = sequence + 1
+        self.offsets[stream] = offset + len(data) // wavefx.nBlockAlign * audiocodec.framesPerBlock(wavefx)
+        self._send(packHeader(stream, sequence, offset, wavefx, len(data)), data)
+
+    def end(self, stream, wavefx):
+        """send the end of `stream`"""
+        sequence = self.sequences.pop(stream, 0)
+        offset = self.offsets.pop(stream, 0)
+        self._send(packHeader(stream, sequence, offset, wavefx, 0, FLAG_END), b'')
+
+    def _send(self, header, data):
+        self.frames += 1
+        self.bytes += len(header) + len(data)
+        if not hasattr(self.sock, 'sendmsg'):
+            # Windows sockets have no sendmsg
+            self.sock.sendall(header + bytes(data))
+            return
+        sent = self.sock.sendmsg([header, data])
+        if sent < len(header):
+            self.sock.sendall(header[sent:])
+            sent = len(header)
+        if sent < len(header) + len(data):
+            self.sock.sendall(data[sent - len(header):])
+
+
+class StreamState(object):
+    """What the Demultiplexer knows of one stream"""
+    def __init__(self, stream):
+        self.stream = stream
+        self.format = None   # header fields wavefx was made of
+        self.wavefx = None
+        self.sequence = 0    #: next expected sequence number
+        self.offset = 0      #: next expected sample frame
+        self.frames = 0
+        self.bytes = 0
+        self.lost = 0        #: frames missing by sequence number
+        self.ended = False
+
+    def stats(self):
+        return {'frames': self.frames, 'bytes': self.bytes, 'lost': self.lost,
+                'offset': self.offset, 'ended': self.ended}
+
+
+class Demultiplexer(object):
+    """Split received data into the frames of its streams.
+
+         Data is received into buffer() and reported by received(), which
+         calls `onFrame(frame, payload)` for every complete frame. A frame
+         must fit `bufferSize` bytes. Data that is not a frame of this
+         protocol raises ValueError, the connection can not be resynced."""
+    def __init__(self, bufferSize=1 << 20):
+        self.data = bytearray(bufferSize)
+        self.view = memoryview(self.data)
+        self.filled = 0
+        self.onFrame = None
+        self.streams = {}   # stream id: StreamState
+        self.frames = 0
+        self.bytes = 0
+
+    def buffer(self):
+        """free part of the receive buffer to recv_into"""
+        return self.view[self.filled:]
+
+    def received(self, nbytes):
+        """parse the frames completed by `nbytes` more bytes in buffer()"""
+        self.filled += nbytes
+        self.bytes += nbytes
+        view = self.view
+        position = 0
+        while self.filled - position >= HEADER.size:
+            magic, version, flags, stream, tag, channels, bits, blockAlign, rate, sequence, offset, length = \
+                HEADER.unpack_from(view, position)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError('not a frame of version %d at byte %d' % (VERSION, self.bytes - self.filled + position))
+            end = position + HEADER.size + length
+            if end > self.filled:
+                if HEADER.size + length > len(self.data):
+                    raise ValueError('frame of %d bytes exceeds the receive buffer' % (HEADER.size + length))
+                break
+            state = self.streams.get(stream)
+            if state is None:
+                state = self.streams[stream] = StreamState(stream)
+            format = (tag, channels, bits, blockAlign, rate)
+            if format != state.format:
+                state.format = format
+                state.wavefx = waveFormat(*format)
+            if sequence != state.sequence:
+                lost = (sequence - state.sequence) & 0xFFFFFFFF
+                if lost < 0x80000000:
+                    state.lost += lost
+                debug("stream %d sequence %d, expected %d", stream, sequence, state.sequence)
+            state.sequence = (sequence + 1) & 0xFFFFFFFF
+            state.offset = offset + length // blockAlign * audiocodec.framesPerBlock(state.wavefx) if blockAlign else offset
+            state.frames += 1
+            state.bytes += length
+            state.ended = bool(flags & FLAG_END)
+            self.frames += 1
+            if self.onFrame:
+                self.onFrame(Frame(stream, sequence, offset, state.wavefx, state.ended),
+                             view[position + HEADER.size:end])
+            position = end
+        if position:
+            # only the start of the next frame is moved
+            rest = self.filled - position
+            view[:rest] = view[position:self.filled]
+            self.filled = rest
+
+    def receive(self, sock):
+        """receive frames from `sock` until the peer closes it, returns the
+             number of frames"""
+        frames = self.frames
+        while True:
+            size = sock.recv_into(self.buffer())
+            if not size:
+                break
+            self.received(size)
+        if self.filled:
+            debug("connection closed inside a frame, %d bytes left", self.filled)
+        return self.frames - frames
+
+    def stats(self):
+        return {stream: state.stats() for (stream, state) in self.streams.items()}
+
+
+class FramedProtocol(asyncio.BufferedProtocol):
+    """asyncio connection of framed streams, asyncio receives straight
+         into the buffer of `demux`"""
+    def __init__(self, demux):
+        self.demux = demux
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def get_buffer(self, sizehint):
+        return self.demux.buffer()
+
+    def buffer_updated(self, nbytes):
+        try:
+            self.demux.received(nbytes)
+        except ValueError as ex:
+            debug("closing connection: %s", ex)
+            self.transport.close()
+
+    def connection_lost(self, exc):
+        pass
+
+
+#-- loopback load generator --
+
+def _sendLoad(address, streams, frames, payload, wavefx):
+    """connect to `address` and send `frames` frames of every stream, one
+         frame of each stream in turn"""
+    sock = socket.create_connection(address)
+    writer = FrameWriter(sock)
+    try:
+        for i in range(frames):
+            for stream in range(streams):
+                writer.send(stream, payload, wavefx)
+        for stream in range(streams):
+            writer.end(stream, wavefx)
+    finally:
+        sock.close()
+
+
+def loadTest(streams=100, seconds=5.0, frameSeconds=0.02, wavefx=None):
+    """Send `seconds` of audio of `streams` streams in frames of
+         `frameSeconds` as fast as possible over a loopback connection to a
+         Demultiplexer, returns a dict of the throughput and the costs per
+         frame of the receiving process"""
+    wavefx = wavefx or audioconvert.pcmFormat(16000, 1)
+    frameBytes = max(1, int(frameSeconds * wavefx.AvgBytesPerSec) // wavefx.nBlockAlign) * wavefx.nBlockAlign
+    frames = max(1, int(round(seconds / frameSeconds)))
+    tone = 10000 * np.sin(2 * np.pi * 440 * np.arange(frameBytes // 2) / wavefx.SamplesPerSec)
+    payload = tone.astype('<i2').tobytes()[:frameBytes]
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    sender = multiprocessing.Process(target=_sendLoad, daemon=True,
+                                     args=(listener.getsockname(), streams, frames, payload, wavefx))
+    sender.start()
+    connection, peer = listener.accept()
+    listener.close()
+    demux = Demultiplexer()
+    payloadBytes = [0]
+    def onFrame(frame, data):
+        payloadBytes[0] += len(data)
+    demux.onFrame = onFrame
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    try:
+        received = demux.receive(connection)
+    finally:
+        connection.close()
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    sender.join()
+    lost = sum(it.lost for it in demux.streams.values())
+    return {'streams': streams, 'frames': received, 'frameBytes': frameBytes,
+            'seconds': wall, 'framesPerSecond': received / wall,
+            'megabytesPerSecond': demux.bytes / wall / 2**20,
+            'overhead': 1 - payloadBytes[0] / float(demux.bytes or 1),
+            'microsecondsPerFrame': cpu / max(received, 1) * 1e6,
+            'realtimeStreams': payloadBytes[0] / float(wavefx.AvgBytesPerSec) / wall,
+            'lost': lost}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Loopback load test of the framed stream protocol')
+    parser.add_argument('--streams', type=int, default=100, help='streams multiplexed on the connection (default 100)')
+    parser.add_argument('--seconds', type=float, default=5.0, help='seconds of audio sent per stream (default 5)')
+    parser.add_argument('--frame', type=float, default=0.02, help='seconds of audio per frame (default 0.02)')
+    parser.add_argument('--rate', type=int, default=16000, help='sample rate of the streams (default 16000)')
+    parser.add_argument('--channels', type=int, default=1, help='channels of the streams (default 1)')
+    args = parser.parse_args(argv)
+    result = loadTest(args.streams, args.seconds, args.frame, audioconvert.pcmFormat(args.rate, args.channels))
+    print("%(streams)d streams, %(frames)d frames of %(frameBytes)d bytes in %(seconds).2fs, %(lost)d lost" % result)
+    print("%(framesPerSecond).0f frames/s, %(megabytesPerSecond).1f MB/s, header overhead %(overhead).2f%%"
+          % dict(result, overhead=result['overhead'] * 100))
+    print("receiver %(microsecondsPerFrame).2f us CPU per frame, %(realtimeStreams).0f real time streams" % result)
+
+
+if __name__ == '__main__':
+    main()
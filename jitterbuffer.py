@@ -0,0 +1,218 @@
+#!python3
+# -*- coding:utf-8 -*-
+"""
+Adaptive jitter buffer for network audio streams.
+
+JitterBuffer collects the data of one stream in a ring and serves it in
+whole sample frames once the buffered audio reaches the target depth. The
+arrival jitter is estimated like the RTP interarrival jitter (RFC 3550,
+6.4.1) from the arrival time of the data compared to its media time, and
+the target depth follows it between `minDepth` and `maxDepth` seconds.
+The target is never less than the largest read, a read waits until the
+buffer holds all of it. A read counts as an underrun only if the sender
+fell behind its media time by more than the jitter allows, then the buffer
+fills up to the target again before it serves more; writes that do not
+fit count as overruns and drop the oldest data, or wait for room with
+dropOldest=False (senders faster than real time, e.g. files sent by nc).
+
+JitterStream feeds a JitterBuffer from a socket stream on a thread of its
+own and can be played by audiosocket.AudioWriter like the socket itself:
+
+    >>> stream = JitterStream(SocketStream(host=''), aw.wavefx)
+    >>> aw.play(stream)
+    >>> stream.buffer.stats()
+"""
+
+import time
+import threading
+
+DEBUG = False
+def debug(msg, *args):
+    """print `msg` % `args`, formatted only if DEBUG is on"""
+    if DEBUG:
+        print("debug: %s" % (msg % args if args else msg))
+
+#: target depth in multiples of the estimated jitter
+JITTER_FACTOR = 4
+
+
+class JitterBuffer(object):
+    """Buffer of a stream in format `wavefx`, depths are in seconds"""
+    def __init__(self, wavefx, targetDepth=0.1, minDepth=0.02, maxDepth=1.0, adaptive=True, dropOldest=True):
+        self.wavefx = wavefx
+        self.align = wavefx.nBlockAlign
+        self.bytesPerSec = float(wavefx.AvgBytesPerSec)
+        self.minDepth = minDepth
+        self.maxDepth = maxDepth
+        self.adaptive = adaptive
+        self.dropOldest = dropOldest
+        self.target = self._bytes(targetDepth)
+        self.readSize = 0     #: largest read, the target is at least as deep
+        self.ring = bytearray(self._bytes(maxDepth))
+        self.view = memoryview(self.ring)
+        self.readPos = 0
+        self.depth = 0        #: buffered bytes
+        self.primed = False   #: filled up to the target, reads are served
+        self.closed = False   #: no more data will come, serve what is left
+        self.condition = threading.Condition()
+        # jitter estimation
+        self.received = 0
+        self.startTime = None
+        self.mediaStart = None  #: arrival time of media time 0, moved by underruns
+        self.lastTransit = None
+        self.jitter = 0.0
+        # statistics
+        self.underruns = 0
+        self.overruns = 0
+        self.droppedBytes = 0
+
+    def _bytes(self, seconds):
+        size = int(seconds * self.bytesPerSec)
+        return max(size - size % self.align, self.align)
+
+    def _estimate(self, size):
+        now = time.perf_counter()
+        if self.startTime is None:
+            self.startTime = self.mediaStart = now
+        # transit time relative to the first arrival, media time from bytes
+        transit = now - self.startTime - self.received / self.bytesPerSec
+        if self.lastTransit is not None:
+            self.jitter += (abs(transit - self.lastTransit) - self.jitter) / 16
+        self.lastTransit = transit
+        self.received += size
+        if self.adaptive:
+            depth = min(max(JITTER_FACTOR * self.jitter, self.minDepth), self.maxDepth)
+            self.target = max(self._bytes(depth), self.readSize)
+
+    def write(self, data):
+        """append received data, if the buffer is full the oldest frames
+             are dropped or the writer waits for room"""
+        data = memoryview(data).cast('B')
+        capacity = len(self.ring)
+        with self.condition:
+            self._estimate(len(data))
+            if self.dropOldest:
+                excess = len(data) - capacity
+                if excess > 0:
+                    excess += -excess % self.align
+                    data = data[excess:]
+                    self.overruns += 1
+                    self.droppedBytes += excess
+                self._write(data)
+                return
+            for start in range(0, len(data), capacity):
+                piece = data[start:start + capacity]
+                if self.depth + len(piece) > capacity:
+                    self.overruns += 1
+                    self.condition.wait_for(lambda: self.depth + len(piece) <= capacity or self.closed)
+                self._write(piece)
+
+    def _write(self, data):
+        capacity = len(self.ring)
+        overflow = self.depth + len(data) - capacity
+        if overflow > 0:
+            overflow += -overflow % self.align
+            self.readPos = (self.readPos + overflow) % capacity
+            self.depth -= overflow
+            self.overruns += 1
+            self.droppedBytes += overflow
+        writePos = (self.readPos + self.depth) % capacity
+        first = min(len(data), capacity - writePos)
+        self.view[writePos:writePos + first] = data[:first]
+        self.view[:len(data) - first] = data[first:]
+        self.depth += len(data)
+        if self.depth >= self.target:
+            self.primed = True
+        self.condition.notify_all()
+
+    def close(self):
+        """the stream ended, the rest of the data will be served"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def readinto(self, buffer, timeout=None):
+        """Fill `buffer` with whole frames.
+
+             Waits until the buffer is primed and holds the request, at most
+             `timeout` seconds. Returns the number of bytes, less than asked
+             for only after close() or a timeout, 0 at the end of stream."""
+        buffer = memoryview(buffer).cast('B')
+        wanted = min(len(buffer), len(self.ring))
+        wanted -= wanted % self.align
+        with self.condition:
+            if wanted > self.readSize:
+                self.readSize = wanted
+                self.target = max(self.target, wanted)
+            if self.primed and self.depth < wanted and not self.closed and self._late():
+                # the stream fell behind, fill up to the target again
+                self.underruns += 1
+                self.primed = False
+                debug("underrun, depth %d/%d bytes", self.depth, self.target)
+            self.condition.wait_for(lambda: self.closed or (self.primed and self.depth >= wanted), timeout)
+            size = min(wanted, self.depth - self.depth % self.align)
+            capacity = len(self.ring)
+            first = min(size, capacity - self.readPos)
+            buffer[:first] = self.view[self.readPos:self.readPos + first]
+            buffer[first:size] = self.view[:size - first]
+            self.readPos = (self.readPos + size) % capacity
+            self.depth -= size
+            self.condition.notify_all()
+            return size
+
+    def _late(self):
+        """the sender delivered less than its media time since the first
+             arrival minus the jitter allowance"""
+        if self.mediaStart is None:
+            return False
+        now = time.perf_counter()
+        allowance = min(max(JITTER_FACTOR * self.jitter, self.minDepth), self.maxDepth)
+        if self.received >= (now - self.mediaStart - allowance) * self.bytesPerSec:
+            return False
+        # a sender that paused is on time again from here
+        self.mediaStart = now - self.received / self.bytesPerSec
+        return True
+
+    def stats(self):
+        with self.condition:
+            return {'depth': self.depth / self.bytesPerSec,
+                    'target': self.target / self.bytesPerSec,
+                    'jitter': self.jitter,
+                    'underruns': self.underruns,
+                    'overruns': self.overruns,
+                    'droppedBytes': self.droppedBytes}
+
+
+class JitterStream(threading.Thread):
+    """Read `stream` (anything with .readinto()) on a thread into a
+         JitterBuffer, reading from JitterStream serves the buffer"""
+    def __init__(self, stream, wavefx, chunkSize=4096, **options):
+        super(JitterStream, self).__init__()
+        self.daemon = True
+        self.stream = stream
+        self.buffer = JitterBuffer(wavefx, **options)
+        self.chunk = bytearray(chunkSize)
+        self.wavefx = wavefx
+        self.start()
+
+    def run(self):
+        chunk = memoryview(self.chunk)
+        try:
+            while True:
+                size = self.stream.readinto(chunk)
+                if not size:
+                    break
+                self.buffer.write(chunk[:size])
+        except OSError as ex:
+            debug("stream error %s", ex)
+        self.buffer.close()
+
+    def readinto(self, buffer):
+        return self.buffer.readinto(buffer)
+
+    def read(self, size):
+        buffer = bytearray(size)
+        return bytes(buffer[:self.readinto(buffer)])
+
+    def close(self):
+        self.stream.close()
@@ -0,0 +1,109 @@
+#!python3
+# -*- coding:utf-8 -*-
+"""
+Latency profiles and block size auto-tuning of the writers.
+
+The latency of a writer is its block size times the depth of the device
+ring. Small blocks answer quickly but underrun on a loaded host, large
+blocks are safe but lag. A writer whose `latency` attribute names a
+profile is sized by it when it is opened:
+
+    low         10ms blocks, 4 deep:  40ms, live monitoring
+    balanced    50ms blocks, 3 deep: 150ms
+    safe       200ms blocks, 3 deep: 600ms, loaded hosts
+    auto        starts balanced, AutoTuner shrinks the blocks while the
+                device never runs dry and grows them when it does
+
+Block sizes are always whole frames of nBlockAlign bytes:
+
+    >>> aw.latency = 'auto'
+    >>> aw.open('sample.wav')
+    >>> aw.tuner.blockSize                  # changes while playing
+"""
+
+import collections
+
+DEBUG = False
+def debug(msg, *args):
+    """print `msg` % `args`, formatted only if DEBUG is on"""
+    if DEBUG:
+        print("debug: %s" % (msg % args if args else msg))
+
+#: seconds of a block and number of blocks queued on the device
+Profile = collections.namedtuple('Profile', 'blockSeconds blockCount')
+
+PROFILES = {
+    'low': Profile(0.01, 4),
+    'balanced': Profile(0.05, 3),
+    'safe': Profile(0.2, 3),
+}
+
+
+def blockBytes(wavefx, seconds):
+    """bytes of `seconds` of audio rounded down to whole frames, at least
+         one frame"""
+    size = int(seconds * wavefx.AvgBytesPerSec)
+    return max(size - size % wavefx.nBlockAlign, wavefx.nBlockAlign)
+
+
+def profile(name):
+    if name == 'auto':
+        return PROFILES['balanced']
+    if name not in PROFILES:
+        raise ValueError('unknown latency profile %r' % name)
+    return PROFILES[name]
+
+
+def configure(writer):
+    """Size the blocks and the device ring of `writer` (anything with
+         BUFSIZE, wavefx and backend) by its `latency` profile before its
+         buffers are allocated. Returns an AutoTuner for 'auto', else None;
+         BUFSIZE is then the largest block the tuner may choose."""
+    name = getattr(writer, 'latency', None)
+    if not name:
+        return None
+    chosen = profile(name)
+    writer.backend.setBlockCount(chosen.blockCount)
+    writer.BUFSIZE = blockBytes(writer.wavefx, chosen.blockSeconds)
+    if name != 'auto':
+        return None
+    tuner = AutoTuner(writer.wavefx, writer.BUFSIZE)
+    writer.BUFSIZE = tuner.maxSize
+    return tuner
+
+
+class AutoTuner(object):
+    """Block size between `minSeconds` and `maxSeconds` of `wavefx` audio,
+         starting at `blockSize` bytes. It doubles after an underrun of the
+         device and shrinks by a quarter after `quietSeconds` of audio
+         without one."""
+    def __init__(self, wavefx, blockSize, minSeconds=0.005, maxSeconds=0.4, quietSeconds=5.0):
+        self.wavefx = wavefx
+        self.minSize = blockBytes(wavefx, minSeconds)
+        self.maxSize = blockBytes(wavefx, maxSeconds)
+        self.quietBytes = quietSeconds * wavefx.AvgBytesPerSec
+        self.blockSize = min(max(blockSize, self.minSize), self.maxSize)
+        self.underruns = 0
+        self.quiet = 0   #: bytes scheduled since the last change
+        self.changes = 0
+
+    def update(self, underruns, scheduled):
+        """Report the underrun count of the device and the bytes of the
+             block just scheduled, returns the size of the next block"""
+        if underruns > self.underruns:
+            self.underruns = underruns
+            self._resize(self.blockSize * 2)
+        else:
+            self.quiet += scheduled
+            if self.quiet >= self.quietBytes:
+                self._resize(self.blockSize * 3 // 4)
+        return self.blockSize
+
+    def _resize(self, size):
+        size -= size % self.wavefx.nBlockAlign
+        size = min(max(size, self.minSize), self.maxSize)
+        self.quiet = 0
+        if size != self.blockSize:
+            debug("block size %d -> %d bytes", self.blockSize, size)
+            self.blockSize = size
+            self.changes += 1
@@ -0,0 +1,298 @@
+#!python3
+# -*- coding:utf-8 -*-
+"""
+Persistent cache of multi-resolution level pyramids of audio files.
+
+A Pyramid holds the peak and mean square of a file over windows of
+BASE_FRAMES frames and over every coarser level, each FACTOR times longer,
+down to a single window. It is built by one streaming pass over the memory
+mapped file and answers level overviews, the levels of any range (e.g.
+around a seek target) and offline excitation without reading the audio
+again:
+
+    >>> cache = LevelCache()
+    >>> pyramid = cache.get('meeting.wav')      # built on the first call
+    >>> peak, rms = pyramid.overview(600)       # 600 columns of a view
+    >>> pyramid.rangeLevels(frame, frame + 44100)
+
+Pyramids are stored in one compact binary file each in a cache directory,
+named by the hash of the absolute path of the audio file. The header keeps
+the size and modification time of the file, a file that changed is
+analyzed again. The least recently used pyramids are evicted when the
+directory grows over `maxBytes`, the last `memoryItems` are kept loaded.
+"""
+
+import os
+import struct
+import hashlib
+import collections
+import numpy as np
+import audioconvert
+import wavfile
+
+DEBUG = False
+def debug(msg, *args):
+    """print `msg` % `args`, formatted only if DEBUG is on"""
+    if DEBUG:
+        print("debug: %s" % (msg % args if args else msg))
+
+#: frames of a window of the finest level
+BASE_FRAMES = 256
+#: windows of a level merged into one window of the next level
+FACTOR = 4
+#: bytes read from the file at a time while building
+CHUNK_SIZE = 4 * 2**20
+
+MAGIC = b'LVLP'
+VERSION = 1
+# magic, version, file size, mtime ns, rate, channels, base frames, factor, frames, levels
+HEADER = struct.Struct('<4sHQqIHIHQH')
+
+
+def defaultDirectory():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pyqtwavplayer', 'levels')
+
+
+class Pyramid(object):
+    """Levels of a file, `peaks[k]` (uint16) and `squares[k]` (float32)
+         hold level k, whose windows are BASE_FRAMES * FACTOR**k frames"""
+    def __init__(self, sampleRate, channels, frames, peaks, squares, baseFrames=BASE_FRAMES, factor=FACTOR):
+        self.sampleRate = sampleRate
+        self.channels = channels
+        self.frames = frames
+        self.peaks = peaks
+        self.squares = squares
+        self.baseFrames = baseFrames
+        self.factor = factor
+
+    @classmethod
+    def fromBase(cls, sampleRate, channels, frames, peak, square, baseFrames=BASE_FRAMES, factor=FACTOR):
+        """build the coarser levels from the finest one"""
+        peaks, squares = [peak], [square]
+        # the windows of a level are equal but the last one, weigh it by its frames
+        weights = np.full(len(peak), baseFrames, np.float64)
+        if len(weights):
+            weights[-1] = frames - baseFrames * (len(peak) - 1)
+        while len(peaks[-1]) > 1:
+            pad = -len(peaks[-1]) % factor
+            peak = np.concatenate((peaks[-1], np.zeros(pad, np.uint16))).reshape(-1, factor).max(axis=1)
+            energy = np.concatenate((squares[-1] * weights, np.zeros(pad))).reshape(-1, factor).sum(axis=1)
+            weights = np.concatenate((weights, np.zeros(pad))).reshape(-1, factor).sum(axis=1)
+            peaks.append(peak.astype(np.uint16))
+            squares.append((energy / weights).astype(np.float32))
+        return cls(sampleRate, channels, frames, peaks, squares, baseFrames, factor)
+
+    def windowFrames(self, level):
+        return self.baseFrames * self.factor ** level
+
+    def duration(self):
+        return self.frames / float(self.sampleRate)
+
+    def overview(self, columns):
+        """(peak, rms) of about `columns` equal parts of the file, from the
+             coarsest level that still has that many windows"""
+        level = 0
+        while level + 1 < len(self.peaks) and len(self.peaks[level + 1]) >= columns:
+            level += 1
+        peak, square = self.peaks[level], self.squares[level]
+        if len(peak) > columns:
+            edges = np.linspace(0, len(peak), columns + 1).astype(int)[:-1]
+            peak = np.maximum.reduceat(peak, edges)
+            square = np.add.reduceat(square.astype(np.float64), edges) / np.diff(np.append(edges, len(square)))
+        return peak.astype(np.int32), np.sqrt(square).astype(np.float32)
+
+    def rangeLevels(self, start, end):
+        """(peak, rms) of frames start..end, to the finest level"""
+        first = max(start, 0) // self.baseFrames
+        last = max(-(-min(end, self.frames) // self.baseFrames), first + 1)
+        peak = self.peaks[0][first:last]
+        if not len(peak):
+            return 0, 0.0
+        return int(peak.max()), float(np.sqrt(self.squares[0][first:last].mean()))
+
+    def blockPeaks(self, starts):
+        """peak of the blocks starting at frames `starts` (ascending), to
+             the nearest window of the finest level"""
+        edges = np.unique(np.minimum(np.round(np.asarray(starts) / float(self.baseFrames)).astype(int),
+                                     len(self.peaks[0]) - 1))
+        if not len(self.peaks[0]):
+            return edges, np.zeros(0, np.uint16)
+        return edges, np.maximum.reduceat(self.peaks[0], edges)
+
+    def windowLevels(self, window, block):
+        """average block peak of every `window` seconds cut into blocks of
+             `block` seconds, audioexcite.segmentLevels from the pyramid"""
+        windowFrames = int(window * self.sampleRate)
+        blockFrames = int(block * self.sampleRate)
+        windows = -(-self.frames // windowFrames) if windowFrames else 0
+        if not windows or not len(self.peaks[0]):
+            return np.zeros(0)
+        starts = (np.arange(windows)[:, None] * windowFrames + np.arange(0, windowFrames, max(blockFrames, 1))).ravel()
+        edges, peaks = self.blockPeaks(starts[starts < self.frames])
+        owner = np.minimum(edges * self.baseFrames // windowFrames, windows - 1)
+        return np.bincount(owner, peaks, windows) / np.maximum(np.bincount(owner, minlength=windows), 1)
+
+    def save(self, path, size, mtime):
+        with open(path + '.tmp', 'wb') as file:
+            file.write(HEADER.pack(MAGIC, VERSION, size, mtime, self.sampleRate, self.channels,
+                                   self.baseFrames, self.factor, self.frames, len(self.peaks)))
+            for (peak, square) in zip(self.peaks, self.squares):
+                file.write(struct.pack('<Q', len(peak)))
+                file.write(peak.astype('<u2').tobytes())
+                file.write(square.astype('<f4').tobytes())
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path, size, mtime):
+        """the pyramid stored at `path`, None if it is missing, damaged or
+             of another version of the audio file"""
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            return None
+        if len(data) < HEADER.size:
+            return None
+        magic, version, fileSize, fileTime, rate, channels, baseFrames, factor, frames, levels = \
+            HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION or fileSize != size or fileTime != mtime:
+            return None
+        peaks, squares = [], []
+        offset = HEADER.size
+        try:
+            for i in range(levels):
+                count = struct.unpack_from('<Q', data, offset)[0]
+                offset += 8
+                peaks.append(np.frombuffer(data, '<u2', count, offset))
+                offset += 2 * count
+                squares.append(np.frombuffer(data, '<f4', count, offset))
+                offset += 4 * count
+        except (struct.error, ValueError):
+            return None
+        return cls(rate, channels, frames, peaks, squares, baseFrames, factor)
+
+
+def analyze(path, baseFrames=BASE_FRAMES):
+    """Pyramid of the audio file `path` from one streaming pass"""
+    reader = wavfile.openReader(path)
+    try:
+        wavefx = reader.wavefx
+        channels = wavefx.nChannels
+        windowSamples = baseFrames * channels
+        chunk = max(CHUNK_SIZE - CHUNK_SIZE % wavefx.nBlockAlign, wavefx.nBlockAlign)
+        peaks, squares = [], []
+        rest = np.zeros(0, np.int16)
+        frames = 0
+        while True:
+            data = reader.block(chunk)
+            if not len(data):
+                break
+            samples = audioconvert.toInt16(data, wavefx)
+            frames += len(samples) // channels
+            if len(rest):
+                samples = np.concatenate((rest, samples))
+            used = len(samples) - len(samples) % windowSamples
+            _measure(samples[:used].reshape(-1, windowSamples), peaks, squares)
+            rest = samples[used:].copy()
+        if len(rest):
+            _measure(rest.reshape(1, -1), peaks, squares)
+        peak = np.concatenate(peaks) if peaks else np.zeros(0, np.uint16)
+        square = np.concatenate(squares) if squares else np.zeros(0, np.float32)
+        return Pyramid.fromBase(wavefx.SamplesPerSec, channels, frames, peak, square, baseFrames)
+    finally:
+        reader.close()
+
+
+def _measure(windows, peaks, squares):
+    if not len(windows):
+        return
+    # abs(-32768) does not fit int16, take the peak from both extremes
+    peak = np.maximum(windows.max(axis=1).astype(np.int32), -windows.min(axis=1).astype(np.int32))
+    floats = windows.astype(np.float32)
+    peaks.append(peak.astype(np.uint16))
+    squares.append((np.einsum('ij,ij->i', floats, floats) / windows.shape[1]).astype(np.float32))
+
+
+class LevelCache(object):
+    """Pyramids of audio files kept in `directory`, at most `maxBytes` on
+         disk and `memoryItems` loaded"""
+    def __init__(self, directory=None, maxBytes=256 * 2**20, memoryItems=16):
+        self.directory = directory or defaultDirectory()
+        self.maxBytes = maxBytes
+        self.memoryItems = memoryItems
+        self.loaded = collections.OrderedDict()   # (path, size, mtime): Pyramid
+        self.hits = 0
+        self.misses = 0
+
+    def sidecar(self, path):
+        """cache file of the audio file `path`"""
+        key = hashlib.sha1(os.path.abspath(path).encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(self.directory, key + '.lvl')
+
+    def get(self, path, build=True):
+        """Pyramid of `path`, analyzed and stored if it is not cached or
+             the file changed. None if not cached and `build` is False."""
+        status = os.stat(path)
+        key = (os.path.abspath(path), status.st_size, status.st_mtime_ns)
+        pyramid = self.loaded.get(key)
+        if pyramid is not None:
+            self.loaded.move_to_end(key)
+            self.hits += 1
+            return pyramid
+        sidecar = self.sidecar(path)
+        pyramid = Pyramid.load(sidecar, status.st_size, status.st_mtime_ns)
+        if pyramid is not None:
+            self.hits += 1
+            self._touch(sidecar)
+        elif not build:
+            return None
+        else:
+            self.misses += 1
+            debug("analyzing %s", path)
+            pyramid = analyze(path)
+            os.makedirs(self.directory, exist_ok=True)
+            pyramid.save(sidecar, status.st_size, status.st_mtime_ns)
+            self.evict()
+        self.loaded[key] = pyramid
+        while len(self.loaded) > self.memoryItems:
+            self.loaded.popitem(last=False)
+        return pyramid
+
+    def _touch(self, sidecar):
+        # the modification time of a cache file is its last use
+        try:
+            os.utime(sidecar)
+        except OSError:
+            pass
+
+    def evict(self):
+        """remove the least recently used cache files over maxBytes"""
+        try:
+            names = [os.path.join(self.directory, it) for it in os.listdir(self.directory) if it.endswith('.lvl')]
+        except OSError:
+            return
+        files = []
+        for it in names:
+            try:
+                status = os.stat(it)
+            except OSError:
+                continue
+            files.append((status.st_mtime, status.st_size, it))
+        files.sort()
+        total = sum(it[1] for it in files)
+        for (mtime, size, it) in files:
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(it)
+                total -= size
+                debug("evicted %s", it)
+            except OSError:
+                pass
+
+    def clear(self):
+        self.loaded.clear()
+        self.maxBytes, maxBytes = 0, self.maxBytes
+        self.evict()
+        self.maxBytes = maxBytes
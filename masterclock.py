@@ -0,0 +1,148 @@
+#!python3
+# -*- coding:utf-8 -*-
+"""
+Master clock of writers that play time aligned streams.
+
+Writers started one after another and paused one by one drift apart by
+the time between the calls, and the excitation compares levels of
+different moments. A MasterClock shared by audiocore.AudioWriter threads
+keeps them at the same sample index:
+
+    start   every writer waits at a barrier before its first block, all of
+            them schedule frame 0 at the same time
+    pause   the hold point is the furthest frame any writer has scheduled,
+            the others read blocks cut to end exactly there and wait
+    stop    like pause, the writers end at the same frame
+
+The writers report the frames the device has played, drift() gives how far
+each one is ahead of the slowest, e.g. sound cards whose clocks disagree:
+
+    >>> clock = MasterClock()
+    >>> for path in paths:
+    ...     clock.add(openWriter(path))
+    >>> clock.start()
+    >>> clock.pause(); clock.resume()
+    >>> clock.drift()                    # {(index, file): seconds ahead}
+
+Frames are counted at the sample rate of each writer, the streams of one
+clock are expected to share it.
+"""
+
+import time
+import threading
+
+DEBUG = False
+def debug(msg, *args):
+    """print `msg` % `args`, formatted only if DEBUG is on"""
+    if DEBUG:
+        print("debug: %s" % (msg % args if args else msg))
+
+
+class MasterClock(object):
+    """Start, pause and stop a group of writers at the same sample index"""
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.writers = []
+        self.scheduled = {}   # writer: frames scheduled or granted to be
+        self.granted = {}     # writer: frames of the last allowance not yet read
+        self.played = {}      # writer: frames its device finished
+        self.finished = set()
+        self.holdAt = None    #: frame the writers pause at
+        self.stopAt = None    #: frame the writers end at
+        self.barrier = None
+        self.started = None
+
+    def add(self, writer):
+        """let the clock drive `writer`, an opened audiocore.AudioWriter"""
+        writer.clock = self
+        self.writers.append(writer)
+        self.scheduled[writer] = 0
+        self.granted[writer] = 0
+        self.played[writer] = 0
+
+    def start(self):
+        """start the threads of all writers, they play their first frame
+             together"""
+        self.barrier = threading.Barrier(len(self.writers), action=self._go)
+        for writer in self.writers:
+            writer.start()
+
+    def _go(self):
+        self.started = time.perf_counter()
+        debug("%d writers started", len(self.writers))
+
+    def ready(self, writer):
+        """called by the writer thread before its first block"""
+        self.barrier.wait()
+
+    def pause(self):
+        """hold all writers at the furthest scheduled frame"""
+        with self.condition:
+            self.holdAt = max(self.scheduled.values())
+            self.condition.notify_all()
+        debug("pause at frame %d", self.holdAt)
+
+    def resume(self):
+        with self.condition:
+            self.holdAt = None
+            self.condition.notify_all()
+
+    def stop(self):
+        """end all writers at the furthest scheduled frame"""
+        with self.condition:
+            self.stopAt = max(self.scheduled.values())
+            self.holdAt = None
+            self.condition.notify_all()
+        debug("stop at frame %d", self.stopAt)
+
+    def isPaused(self):
+        return self.holdAt is not None
+
+    def allowance(self, writer, frames):
+        """Frames of at most `frames` that `writer` may schedule next, cut
+             to end on the hold or stop point. Waits while the writer is
+             held, returns 0 once it reached the stop point.
+
+             The frames count as scheduled at once, so a pause or stop
+             before advance() can not set its point behind them."""
+        with self.condition:
+            position = self.scheduled[writer]
+            while self.holdAt is not None and position >= self.holdAt and self.stopAt is None:
+                self.condition.wait()
+            if self.stopAt is not None:
+                frames = max(0, min(frames, self.stopAt - position))
+            if self.holdAt is not None and self.holdAt >= position:
+                frames = min(frames, self.holdAt - position)
+            self.scheduled[writer] += frames
+            self.granted[writer] = frames
+            return frames
+
+    def advance(self, writer, frames):
+        """`writer` read `frames` frames of its last allowance, fewer at
+             the end of its stream"""
+        with self.condition:
+            self.scheduled[writer] += frames - self.granted[writer]
+            self.granted[writer] = 0
+
+    def complete(self, writer, frames):
+        """the device of `writer` played `frames` more frames"""
+        with self.condition:
+            self.played[writer] += frames
+
+    def finish(self, writer):
+        """`writer` ended, it no longer takes part in drift()"""
+        with self.condition:
+            self.finished.add(writer)
+
+    def drift(self):
+        """seconds every playing writer is ahead of the slowest one, keyed
+             by its index in add() order and its file, writers may play the
+             same file"""
+        with self.condition:
+            playing = [(i, it) for (i, it) in enumerate(self.writers) if it not in self.finished]
+            if not playing:
+                return {}
+            seconds = {(i, getattr(it, 'file', it.name)): self.played[it] / float(it.wavefx.SamplesPerSec)
+                       for (i, it) in playing}
+        slowest = min(seconds.values())
+        return {key: value - slowest for (key, value) in seconds.items()}
@@ -5,13 +5,31 @@
 from PyQt5.QtWidgets import (QApplication, QDialog, QFileDialog,
         QGridLayout, QHBoxLayout, QVBoxLayout, QMessageBox,
         QLabel, QLineEdit, QPushButton, QSpinBox)
-from PyQt5.QtCore import QTimer
-import pyqtAudioWriter
-import math
+from PyQt5.QtCore import QTimer, pyqtSignal
+import threading
+import audiomixer
+import audiometer
+import excitation
+import levelcache
+import spectral
 
 BUTTON_HEIGHT = 30
+METER_WINDOW = 0.05 # seconds, the excitation engine is updated every window
+SPEECH_SCORE = False # select by speech band energy instead of the peak level
+RENDER = 'mix'       # 'selected' plays only the selected file, crossfading on a switch
+METER_REFRESH = 100 # ms, level labels are refreshed at this rate
+LEVEL_CACHE = True # show the peak of every file from the level cache when opened
+
+def overviewText(pyramid):
+    peak = int(pyramid.peaks[-1].max()) if len(pyramid.peaks[0]) else 0
+    if not peak:
+        return 'max 0'
+    return 'max {0:.1f}db'.format(float(audiometer.dbfs(peak)))
 
 class Dialog(QDialog):
+    #: path and overview text of a file whose levels were analyzed
+    LevelsReady = pyqtSignal(str, str)
+
     def __init__(self):
         super(Dialog, self).__init__()
         self.setWindowTitle('Audio Excitation(语音激励)')
@@ -48,11 +66,13 @@ class Dialog(QDialog):
 
         self.edits = []
         self.labels = []
-        self.audios = []
-        self.audioValues = []
-        self.timer = QTimer()
-        self.timer.setInterval(2000)
-        self.timer.timeout.connect(self.caculate)
+        self.mixer = None
+        self.shownSequence = -1 # meter sequence shown in the labels
+        self.meterTimer = QTimer()
+        self.meterTimer.setInterval(METER_REFRESH)
+        self.meterTimer.timeout.connect(self.updateUI)
+        self.levelCache = levelcache.LevelCache() if LEVEL_CACHE else None
+        self.LevelsReady.connect(self.showOverview)
 
     def closeEvent(self, event):
         self.stop()
@@ -72,34 +92,78 @@ class Dialog(QDialog):
                     break
             self.edits.clear()
             self.labels.clear()
-            self.audioValues.clear()
+            missing = []
             for (i, it) in enumerate(fileNames):
                 label = QLabel('wave {0}'.format(i+1))
                 self.gridLayout.addWidget(label, i, 0)
                 edit = QLineEdit(it)
                 self.edits.append(edit)
                 self.gridLayout.addWidget(edit, i, 1)
-                label = QLabel('value')
+                label = QLabel(self.overview(it, missing))
                 label.setFixedWidth(80)
                 self.labels.append(label)
                 self.gridLayout.addWidget(label, i, 2)
-                self.audioValues.append([0,0])
+            if missing:
+                # large files take seconds to analyze, not on the GUI thread
+                thread = threading.Thread(target=self.buildLevels, args=(missing,))
+                thread.daemon = True
+                thread.start()
+
+    def overview(self, path, missing):
+        # peak of the whole file if it was analyzed before, else the path
+        # is added to `missing`
+        if not self.levelCache:
+            return 'value'
+        try:
+            pyramid = self.levelCache.get(path, build=False)
+        except (OSError, ValueError):
+            return 'value'
+        if pyramid is None:
+            missing.append(path)
+            return 'analyzing'
+        return overviewText(pyramid)
+
+    def buildLevels(self, paths):
+        # runs on a thread with a cache of its own, the GUI thread uses
+        # self.levelCache at the same time
+        cache = levelcache.LevelCache(self.levelCache.directory, self.levelCache.maxBytes)
+        for it in paths:
+            try:
+                text = overviewText(cache.get(it))
+            except (OSError, ValueError):
+                text = 'value'
+            self.LevelsReady.emit(it, text)
+
+    def showOverview(self, path, text):
+        for (edit, label) in zip(self.edits, self.labels):
+            # files opened since and live levels are not overwritten
+            if edit.text() == path and label.text() == 'analyzing':
+                label.setText(text)
 
     def play(self):
-        for it in self.audios:
-            if it.isPlaying():
-                return
-        self.audios.clear()
-        for it in self.edits:
-            audio = pyqtAudioWriter.AudioWriter()
-            audio.UpdateUI.connect(self.updateUI)
-            audio.open(it.text())
-            audio.start()
-            self.audios.append(audio)
-        self.timer.start()
+        if self.mixer and self.mixer.isPlaying():
+            return
+        self.mixer = audiomixer.AudioMixer()
+        try:
+            for it in self.edits:
+                self.mixer.addInput(it.text())
+            self.mixer.open()
+        except (OSError, ValueError) as ex:
+            QMessageBox.warning(self, 'Play', str(ex))
+            self.mixer = None
+            return
+        self.mixer.meterFrames = int(self.mixer.wavefx.SamplesPerSec * METER_WINDOW)
+        self.mixer.excitation = excitation.ExcitationEngine(len(self.mixer.inputs), METER_WINDOW)
+        self.mixer.render = RENDER
+        if SPEECH_SCORE:
+            self.mixer.spectral = spectral.SpectralAnalyzer(self.mixer.wavefx.SamplesPerSec,
+                                                            self.mixer.wavefx.nChannels)
+        self.shownSequence = -1
+        self.mixer.start()
+        self.meterTimer.start()
 
     def pauseOrResume(self):
-        if self.audios and self.audios[0].isPlaying():
+        if self.mixer and self.mixer.isPlaying():
             btnText = self.prButton.text()
             if btnText == 'Pause':
                 self.pause()
@@ -107,50 +171,41 @@ class Dialog(QDialog):
                 self.resume()
 
     def pause(self):
-        for it in self.audios:
-            it.pause()
+        if self.mixer:
+            self.mixer.pause()
         self.prButton.setText('Resume')
 
     def resume(self):
-        for it in self.audios:
-            it.resume()
+        if self.mixer:
+            self.mixer.resume()
         self.prButton.setText('Pause')
 
     def stop(self):
         self.resume()
-        for it in self.audios:
-            it.stop()
-        # self.audios.clear() # del sender cause error, can't del sender in its slot
-        self.timer.stop()
-        for it in self.audioValues:
-            it[0] = 0
-            it[1] = 0
-
-    def updateUI(self, value):
-        index = self.audios.index(self.sender())
-        if value:
-            db = 20 * math.log10(value / (1<<15))
-            self.labels[index].setText('{0:<5} {1:.1f}db'.format(value, db))
-        else:
-            self.labels[index].setText('{0:<5}'.format(value))
-        self.audioValues[index][0] += value
-        self.audioValues[index][1] += 1
+        if self.mixer:
+            self.mixer.stop()
+        self.meterTimer.stop()
+
+    def updateUI(self):
+        snapshot = self.mixer.meters.snapshot()
+        if snapshot.sequence != self.shownSequence:
+            self.shownSequence = snapshot.sequence
+            dbs = audiometer.dbfs(snapshot.peak)
+            for (index, value) in enumerate(snapshot.peak.tolist()):
+                if value:
+                    self.labels[index].setText('{0:<5} {1:.1f}db'.format(value, dbs[index]))
+                else:
+                    self.labels[index].setText('{0:<5}'.format(value))
+        self.caculate()
 
     def caculate(self):
-        index, max = 0, 0
-        for (i, it) in enumerate(self.audioValues):
-            if it[1]:
-                average = it[0]/it[1]
-                it[0] = 0
-                it[1] = 0
-                if max < average:
-                    max = average
-                    index = i
-        self.label.setText('select {0}'.format(index+1))
-        for it in self.audios:
-            if it.isPlaying():
-                return
-        self.timer.stop()
+        # the excitation engine selects on every meter window in the mixer
+        index = self.mixer.selected
+        if index is not None:
+            self.label.setText('select {0}'.format(index+1))
+        if self.mixer.isPlaying():
+            return
+        self.meterTimer.stop()
 
 if __name__ == '__main__':
     import sys
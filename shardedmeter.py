@@ -0,0 +1,163 @@
+#!python3
+# -*- coding:utf-8 -*-
+"""
+Level metering of many streams sharded over worker processes.
+
+One process meters a few hundred streams at the pace of a single core,
+the GIL keeps threads from helping. ShardedMeter splits the streams into
+contiguous groups, one per worker process. Block samples and levels are
+exchanged through a multiprocessing.shared_memory segment: the main process
+reads the blocks of all streams straight into shared rows, every worker
+runs audiometer.measure over its rows and writes peak and RMS back next to
+them. Only the slot and sample count of a block cross the pipes.
+
+Blocks go through a ring of `ringBlocks` slots, so the main process can
+mix, schedule or read the next block while the workers meter this one:
+
+    >>> meter = ShardedMeter(len(streams), samples, channels, windowFrames)
+    >>> blocks = meter.blocks[slot]              # read the streams into it
+    >>> meter.submit(slot, count)
+    >>> levels = meter.collect(slot)             # audiometer.Levels
+    >>> meter.close()
+
+The selection (excitation.ExcitationEngine) stays in the main process, its
+cost per window is a few vectorized operations over the stream peaks.
+"""
+
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import audiometer
+
+DEBUG = False
+def debug(msg, *args):
+    """print `msg` % `args`, formatted only if DEBUG is on"""
+    if DEBUG:
+        print("debug: %s" % (msg % args if args else msg))
+
+
+def windowCount(frames, windowFrames):
+    """windows audiometer.measure splits `frames` frames into"""
+    if not frames:
+        return 0
+    if not windowFrames or windowFrames > frames:
+        return 1
+    return -(-frames // windowFrames)
+
+
+def _layout(ringBlocks, streams, samples, windows, channels):
+    """(name, dtype, shape, offset) of the arrays in the shared segment"""
+    arrays = [('blocks', np.int16, (ringBlocks, streams, samples)),
+              ('peak', np.int32, (ringBlocks, streams, windows, channels)),
+              ('rms', np.float32, (ringBlocks, streams, windows, channels))]
+    layout = []
+    offset = 0
+    for (name, dtype, shape) in arrays:
+        layout.append((name, dtype, shape, offset))
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        offset += size + -size % 64   # cache line aligned
+    return layout, offset
+
+
+def _arrays(buffer, layout):
+    return {name: np.ndarray(shape, dtype, buffer, offset) for (name, dtype, shape, offset) in layout}
+
+
+def _worker(name, layout, first, last, channels, windowFrames, connection):
+    """meter streams first..last-1 of every slot the main process sends"""
+    segment = shared_memory.SharedMemory(name)
+    arrays = _arrays(segment.buf, layout)
+    blocks, peak, rms = arrays['blocks'], arrays['peak'], arrays['rms']
+    try:
+        while True:
+            task = connection.recv()
+            if task is None:
+                break
+            slot, count = task
+            levels = audiometer.measure(blocks[slot, first:last, :count], channels, windowFrames)
+            windows = levels.peak.shape[1]
+            peak[slot, first:last, :windows] = levels.peak
+            rms[slot, first:last, :windows] = levels.rms
+            connection.send(slot)
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        del arrays, blocks, peak, rms
+        segment.close()
+
+
+class ShardedMeter(object):
+    """Meter `streams` streams of int16 blocks of up to `samples` samples
+         (`channels` interleaved) in windows of `windowFrames` frames with
+         `workers` processes, by default one per CPU"""
+    def __init__(self, streams, samples, channels=1, windowFrames=0, workers=None, ringBlocks=2):
+        self.streams = streams
+        self.channels = channels
+        self.windowFrames = windowFrames
+        self.ringBlocks = ringBlocks
+        workers = max(1, min(workers or multiprocessing.cpu_count(), streams))
+        windows = windowCount(samples // channels, windowFrames)
+        layout, size = _layout(ringBlocks, streams, samples, windows, channels)
+        self.segment = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        arrays = _arrays(self.segment.buf, layout)
+        #: (ringBlocks, streams, samples) int16, rows the streams are read into
+        self.blocks = arrays['blocks']
+        self.peak = arrays['peak']
+        self.rms = arrays['rms']
+        self.blocks[:] = 0
+        self.counts = [0] * ringBlocks
+        self.connections = []
+        self.processes = []
+        bounds = np.linspace(0, streams, workers + 1).astype(int)
+        for i in range(workers):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_worker, daemon=True,
+                                              args=(self.segment.name, layout, bounds[i], bounds[i + 1],
+                                                    channels, windowFrames, child))
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+        debug("%d streams metered by %d processes", streams, workers)
+
+    def submit(self, slot, count):
+        """meter the first `count` samples of every stream in blocks[slot]"""
+        self.counts[slot] = count
+        for connection in self.connections:
+            connection.send((slot, count))
+
+    def collect(self, slot):
+        """wait for the levels of blocks[slot], returns audiometer.Levels
+             of shape (streams, windows, channels), valid until the slot is
+             submitted again"""
+        for connection in self.connections:
+            done = connection.recv()
+            assert done == slot, 'slots must be collected in submission order'
+        windows = windowCount(self.counts[slot] // self.channels, self.windowFrames)
+        return audiometer.Levels(self.peak[slot, :, :windows], self.rms[slot, :, :windows])
+
+    def measure(self, slot, count):
+        """submit() and collect() of one slot"""
+        self.submit(slot, count)
+        return self.collect(slot)
+
+    def close(self):
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+        for connection in self.connections:
+            connection.close()
+        del self.blocks, self.peak, self.rms
+        self.segment.unlink()
+        try:
+            self.segment.close()
+        except BufferError:
+            # levels or block rows are still viewed, the map is released
+            # with the last of them
+            pass
@@ -0,0 +1,113 @@
+#!python3
+# -*- coding:utf-8 -*-
+"""
+Batched spectral features of many streams for excitation scoring.
+
+A block peak lets a door slam or loud line hum win the excitation. The
+features here look at what a talker sounds like: SpectralAnalyzer runs a
+short-time Fourier transform over the blocks of all streams at once and
+reports per stream and per meter window
+
+    band        RMS of the speech band (300-3400Hz), in int16 units
+    flatness    spectral flatness of the band, 0 for tones and voiced
+                speech, towards 1 for noise and clicks
+    zcr         zero-crossing rate, crossings per sample
+
+score() combines them into a level that excitation.ExcitationEngine takes
+in place of the peak: band energy damped by flatness, so broadband bursts
+and hum outside the band lose against speech.
+
+The Hann window and band mask are built once, the samples of the last
+block that did not fill a whole STFT frame are carried over, so the frames
+do not depend on the block size (a frame spanning two blocks counts in the
+later one):
+
+    >>> analyzer = SpectralAnalyzer(16000, channels=1)
+    >>> features = analyzer.measure(blocks, windowFrames=1600)  # (streams, samples)
+    >>> engine.update(score(features)[:, 0])
+"""
+
+import collections
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+#: arrays of shape (streams, windows)
+Features = collections.namedtuple('Features', 'band flatness zcr')
+
+SPEECH_BAND = (300.0, 3400.0)
+#: mean flatness of a single periodogram frame of white noise, exp(-gamma)
+NOISE_FLATNESS = 0.5615
+
+
+class SpectralAnalyzer(object):
+    """STFT features of int16 streams of `channels` interleaved channels
+         at `sampleRate`, frames of `frameSize` samples every `hop`"""
+    def __init__(self, sampleRate, channels=1, frameSize=512, hop=None, band=SPEECH_BAND):
+        self.sampleRate = sampleRate
+        self.channels = channels
+        self.frameSize = frameSize
+        self.hop = hop or frameSize // 2
+        self.window = np.hanning(frameSize).astype(np.float32)
+        frequencies = np.fft.rfftfreq(frameSize, 1.0 / sampleRate)
+        self.bandMask = (frequencies >= band[0]) & (frequencies <= band[1])
+        # Parseval: the band power of a frame is its RMS squared
+        self.scale = 2.0 / (self.window ** 2).sum() / frameSize
+        #: mono samples of every stream not yet covered by a frame
+        self.tail = None
+
+    def reset(self):
+        self.tail = None
+
+    def measure(self, samples, windowFrames=0):
+        """Features of a block of every stream, `samples` is int16 of shape
+             (streams, samples). The block is split into windows of
+             `windowFrames` frames like audiometer.measure, a frame belongs
+             to the window of its center. Windows without a frame are NaN."""
+        samples = np.asarray(samples)
+        streams = samples.shape[0]
+        frames = samples.shape[-1] // self.channels
+        mono = samples[:, :frames * self.channels].reshape(streams, frames, self.channels)
+        mono = mono.mean(axis=2, dtype=np.float32) if self.channels > 1 else mono[:, :, 0].astype(np.float32)
+        if self.tail is None or self.tail.shape[0] != streams:
+            self.tail = np.zeros((streams, 0), np.float32)
+        carried = self.tail.shape[1]
+        buffer = np.concatenate((self.tail, mono), axis=1)
+        count = max(0, (buffer.shape[1] - self.frameSize) // self.hop + 1)
+        self.tail = buffer[:, count * self.hop:]
+
+        if not windowFrames or windowFrames > frames:
+            windowFrames = frames
+        windows = -(-frames // windowFrames) if frames else 0
+        if not count or not windows:
+            empty = np.full((streams, windows), np.nan)
+            return Features(empty, empty.copy(), empty.copy())
+
+        # (streams, count, frameSize) view of the overlapping frames
+        stride = buffer.strides
+        framed = as_strided(buffer, (streams, count, self.frameSize), (stride[0], stride[1] * self.hop, stride[1]))
+        spectrum = np.fft.rfft(framed * self.window, axis=2)
+        power = (spectrum.real ** 2 + spectrum.imag ** 2)[:, :, self.bandMask]
+        band = power.sum(axis=2) * self.scale
+        power += 1e-3
+        flatness = np.exp(np.log(power).mean(axis=2)) / power.mean(axis=2)
+        signs = np.signbit(framed)
+        zcr = (signs[:, :, 1:] != signs[:, :, :-1]).mean(axis=2)
+
+        # frames are averaged into the window of their center
+        centers = np.arange(count) * self.hop + self.frameSize // 2 - carried
+        owner = np.clip(centers, 0, frames - 1) // windowFrames
+        assign = np.zeros((count, windows), np.float32)
+        assign[np.arange(count), owner] = 1
+        counts = assign.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return Features(np.sqrt(band.dot(assign) / counts),
+                            flatness.dot(assign) / counts,
+                            zcr.dot(assign) / counts)
+
+
+def score(features):
+    """Speech level of every stream and window, comparable to a peak in
+         int16 units: the band RMS, down to 0 as the flatness approaches
+         that of white noise. 0 where there were no frames."""
+    level = features.band * np.clip(1 - features.flatness / NOISE_FLATNESS, 0, 1)
+    return np.nan_to_num(level)
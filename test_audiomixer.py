@@ -0,0 +1,54 @@
+#!python3
+# -*- coding:utf-8 -*-
+"""
+Tests of the mixer, run with python -m unittest test_audiomixer
+"""
+
+import io
+import os
+import tempfile
+import unittest
+import numpy as np
+import audiobackend
+import audioconvert
+import audiomixer
+
+RATE = 8000
+
+
+def tone(seconds, amplitude):
+    t = np.arange(int(seconds * RATE)) / float(RATE)
+    return (amplitude * np.sin(2 * np.pi * 440 * t)).astype('<i2').tobytes()
+
+
+class MixerTest(unittest.TestCase):
+    def mix(self, inputs, meterWorkers):
+        """raw output of the mixer playing `inputs` (seconds, amplitude)"""
+        wavefx = audioconvert.pcmFormat(RATE, 1)
+        handle, path = tempfile.mkstemp('.pcm')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        mixer = audiomixer.AudioMixer(audiobackend.FileBackend(path))
+        for (i, (seconds, amplitude)) in enumerate(inputs):
+            mixer.addInput(audiomixer.MixerInput(io.BytesIO(tone(seconds, amplitude)), str(i), wavefx))
+        mixer.BUFSIZE = 1600
+        mixer.meterFrames = 400
+        mixer.meterWorkers = meterWorkers
+        mixer.open()
+        mixer.start()
+        mixer.join(30)
+        mixer.close()
+        with open(path, 'rb') as file:
+            return np.frombuffer(file.read(), '<i2')
+
+    def testShardedInputsOfUnequalLength(self):
+        inputs = [(1.0, 20000), (4.0, 1000)]
+        sharded = self.mix(inputs, meterWorkers=2)
+        local = self.mix(inputs, meterWorkers=0)
+        self.assertTrue(np.array_equal(sharded, local))
+        # the finished loud input must not be played again
+        self.assertLessEqual(int(np.abs(sharded[RATE + 800:].astype(np.int32)).max()), 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
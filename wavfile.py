@@ -0,0 +1,150 @@
+#!python3
+# -*- coding:utf-8 -*-
+"""
+Memory mapped readers of RIFF/WAVE and raw PCM files.
+
+WavReader walks the RIFF chunks to find `fmt ` and `data` (LIST, fact and
+other chunks are skipped), builds the WAVEFORMATEX the output device is
+opened with and maps the file into memory. Blocks of the data chunk are
+served as memoryview slices of the map, so opening a multi-gigabyte file
+costs nothing and seeking is O(1):
+
+    >>> reader = openReader('meeting.wav')
+    >>> backend.open(reader.wavefx)
+    >>> reader.seek(reader.wavefx.SamplesPerSec * 60)   # skip one minute
+    >>> data = reader.block(40*2**10)                   # zero-copy slice
+
+The map is copy-on-write, the slices are writable buffers that can be
+handed to the device like any other block buffer.
+"""
+
+import os
+import mmap
+import struct
+import audiobackend
+import audiocodec
+
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class PcmReader(object):
+    """Raw PCM file in the format `wavefx` (audiobackend.defaultFormat()
+         by default), the audio data starts `offset` bytes into the file"""
+    def __init__(self, path, wavefx=None, offset=0, size=None):
+        self.path = path
+        self.wavefx = wavefx or audiobackend.defaultFormat()
+        #: frames of every nBlockAlign bytes, more than one for ADPCM
+        self.framesPerBlock = audiocodec.framesPerBlock(self.wavefx)
+        self.file = open(path, 'rb')
+        fileSize = os.fstat(self.file.fileno()).st_size
+        if fileSize:
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_COPY)
+            buffer = memoryview(self.mmap)
+        else:
+            self.mmap = None   # empty files can not be mapped
+            buffer = memoryview(bytearray())
+        if size is None or offset + size > fileSize:
+            size = max(fileSize - offset, 0)
+        size -= size % self.wavefx.nBlockAlign
+        #: the audio data, memoryview of the map
+        self.data = buffer[offset:offset + size]
+        buffer.release()
+        self.position = 0
+
+    def frames(self):
+        """number of sample frames"""
+        return len(self.data) // self.wavefx.nBlockAlign * self.framesPerBlock
+
+    def duration(self):
+        return self.frames() / float(self.wavefx.SamplesPerSec)
+
+    def seek(self, frame):
+        """move to sample frame `frame`, the start of its block for ADPCM"""
+        self.position = min(max(frame, 0), self.frames()) // self.framesPerBlock * self.wavefx.nBlockAlign
+
+    def tell(self):
+        """current sample frame"""
+        return self.position // self.wavefx.nBlockAlign * self.framesPerBlock
+
+    def block(self, size):
+        """Next block of at most `size` bytes aligned to nBlockAlign, as a
+             zero-copy slice of the map. Empty at the end of data."""
+        size -= size % self.wavefx.nBlockAlign
+        start = self.position
+        self.position = min(start + size, len(self.data))
+        return self.data[start:self.position]
+
+    def read(self, size):
+        return self.block(size).tobytes()
+
+    def readinto(self, buffer):
+        """copy the next block into `buffer`, returns the number of bytes"""
+        buffer = memoryview(buffer).cast('B')
+        block = self.block(len(buffer))
+        buffer[:len(block)] = block
+        return len(block)
+
+    def close(self):
+        try:
+            self.data.release()
+            if self.mmap:
+                self.mmap.close()
+        except BufferError:
+            # blocks are still referenced (e.g. queued on the device or
+            # viewed by numpy), the map is released with the last of them
+            pass
+        self.file.close()
+
+
+class WavReader(PcmReader):
+    """RIFF/WAVE file, format and data location are taken from its chunks"""
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            wavefx, offset, size = parseRiff(file)
+        super(WavReader, self).__init__(path, wavefx, offset, size)
+
+
+def parseRiff(file):
+    """Locate `fmt ` and `data` chunks of a RIFF/WAVE file.
+
+         Returns (WAVEFORMATEX, data offset, data size), raises ValueError
+         if the file is not a wave file."""
+    header = file.read(12)
+    if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+        raise ValueError('%s is not a RIFF/WAVE file' % getattr(file, 'name', file))
+    wavefx = None
+    while True:
+        chunk = file.read(8)
+        if len(chunk) < 8:
+            break
+        chunkId, chunkSize = struct.unpack('<4sI', chunk)
+        if chunkId == b'fmt ':
+            wavefx = _parseFormat(file.read(chunkSize))
+            file.seek(chunkSize & 1, os.SEEK_CUR)
+            continue
+        elif chunkId == b'data':
+            if wavefx is None:
+                raise ValueError('data chunk precedes fmt chunk')
+            # recorders that were not stopped cleanly leave the size at 0 or
+            # 0xFFFFFFFF, the reader clamps it to the end of file
+            return wavefx, file.tell(), chunkSize or None
+        # chunks are word aligned
+        file.seek(chunkSize + (chunkSize & 1), os.SEEK_CUR)
+    raise ValueError('no data chunk in %s' % getattr(file, 'name', file))
+
+
+def _parseFormat(data):
+    if len(data) < 16:
+        raise ValueError('fmt chunk is too short')
+    formatTag, channels, rate, byteRate, blockAlign, bits = struct.unpack_from('<HHIIHH', data)
+    if formatTag == WAVE_FORMAT_EXTENSIBLE and len(data) >= 26:
+        # the format tag is the first two bytes of the SubFormat GUID
+        formatTag = struct.unpack_from('<H', data, 24)[0]
+    return audiobackend.WAVEFORMATEX(formatTag, channels, rate, byteRate, blockAlign, bits, 0)
+
+
+def openReader(path, wavefx=None):
+    """WavReader for .wav files, PcmReader in format `wavefx` otherwise"""
+    if path.lower().endswith('.wav'):
+        return WavReader(path)
+    return PcmReader(path, wavefx)